@@ -1,157 +1,1776 @@
-from flask import Flask, request, jsonify, send_file
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, request, jsonify, send_file, g, stream_with_context, has_app_context, has_request_context
 from flask_cors import CORS
 import json
 import os
-from datetime import datetime
+import threading
+import collections
+import select
+import base64
+import hashlib
+import bisect
+import zipfile
+import gzip
+import mimetypes
+import multiprocessing
+import csv
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, date
+from decimal import Decimal, ROUND_HALF_UP
 import uuid
 import io
-import pytz
 import psycopg2 
 import psycopg2.extras as extras
-from psycopg2.extras import Json
-
+from psycopg2.extras import Json, execute_values
 
-# ReportLab imports
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.units import mm
-from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
+# ReportLab is imported lazily by pdf_render (see generate_pdf)
 
 app = Flask(__name__, static_folder='static')
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Total-Count', 'ETag'])
+
+# ============================================
+# METRICS
+# ============================================
+
+class Metrics:
+    """Minimal in-process Prometheus registry (counters and histograms).
+
+    Values are per process; Prometheus sums them across gunicorn workers.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)   # (name, labels) -> value
+        self._histograms = {}                             # (name, labels) -> [buckets, counts, sum, count]
+        self._help = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def observe(self, name, value, buckets=BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[1][i] += 1
+            hist[2] += value
+            hist[3] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{str(v)}"' for k, v in pairs) + '}'
+
+    def render(self, extra=()):
+        """Prometheus text format; ``extra`` holds (name, kind, labels, value)
+        samples read from elsewhere at scrape time"""
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                text = self._help.get(name, (kind, name))[1]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                header(name, 'counter')
+                lines.append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), (buckets, counts, total, count) in sorted(self._histograms.items()):
+                header(name, 'histogram')
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {bucket_count}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        for name, kind, labels, value in extra:
+            header(name, kind)
+            lines.append(f"{name}{self._labels(sorted(labels.items()))} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.describe('http_request_duration_seconds', 'histogram', 'Request latency by route')
+metrics.describe('http_response_size_bytes', 'histogram', 'Response body size by route')
+metrics.describe('db_queries_per_request', 'histogram', 'Database statements executed per request')
+metrics.describe('db_query_duration_seconds', 'histogram', 'Time spent executing database statements, by target')
+metrics.describe('db_reads_total', 'counter', 'Read-only request connections by target (primary or replica)')
+metrics.describe('db_replica_failovers_total', 'counter', 'Times a replica was taken out of rotation, by reason')
+metrics.describe('db_connection_acquire_seconds', 'histogram', 'Time to borrow a connection from the pool')
+metrics.describe('pdf_render_seconds', 'histogram', 'PDF render time by phase (flowables, build)')
+metrics.describe('http_compressed_bytes_saved_total', 'counter', 'Bytes saved by compressing dynamic responses')
+metrics.describe('pdf_size_bytes', 'histogram', 'Size of rendered quote PDFs by quality setting')
+
+# Requests slower than this are logged with their breakdown; unset disables
+SLOW_REQUEST_MS = float(os.environ['SLOW_REQUEST_MS']) if os.environ.get('SLOW_REQUEST_MS') else None
+
+def record_timing(name, seconds):
+    """Add ``seconds`` to the current request's breakdown (if any)"""
+    if has_app_context():
+        timings = g.setdefault('timings', collections.defaultdict(float))
+        timings[name] += seconds
+
+def record_query(seconds, target='primary'):
+    metrics.observe('db_query_duration_seconds', seconds, target=target)
+    if has_app_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        record_timing('db', seconds)
+
+_timed_cursor_classes = {}
+
+def timed_cursor_class(base):
+    """Subclass of cursor class ``base`` that reports statement timings"""
+    cls = _timed_cursor_classes.get(base)
+    if cls is None:
+        class TimedCursor(base):
+            def execute(self, query, vars=None):
+                start = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    record_query(time.perf_counter() - start, self.connection.db_target)
+
+            def executemany(self, query, vars_list):
+                start = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    record_query(time.perf_counter() - start, self.connection.db_target)
+
+            def copy_expert(self, sql, file, size=8192):
+                start = time.perf_counter()
+                try:
+                    return super().copy_expert(sql, file, size)
+                finally:
+                    record_query(time.perf_counter() - start, self.connection.db_target)
+
+        cls = _timed_cursor_classes[base] = TimedCursor
+    return cls
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors (of any cursor_factory) are timed"""
+
+    db_target = 'primary'   # metrics label; replica pools set their own
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = {'route': route, 'method': request.method, 'status': response.status_code}
+    metrics.observe('http_request_duration_seconds', elapsed, **labels)
+    # Header only: computing the length would buffer streamed responses
+    size = response.content_length
+    if size is not None:
+        metrics.observe('http_response_size_bytes', size, buckets=Metrics.SIZE_BUCKETS, route=route, method=request.method)
+    queries = g.get('db_queries', 0)
+    metrics.observe('db_queries_per_request', queries, buckets=(0, 1, 2, 3, 5, 10, 25, 100), route=route)
+
+    if SLOW_REQUEST_MS is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+        breakdown = ' '.join(f"{name}={seconds * 1000:.1f}ms"
+                             for name, seconds in sorted(g.get('timings', {}).items()))
+        print(f"SLOW {request.method} {request.path} {response.status_code} "
+              f"{elapsed * 1000:.1f}ms queries={queries} {breakdown} bytes={size}")
+    return response
 
 # ============================================
 # DATABASE CONNECTION (POSTGRESQL ONLY)
 # ============================================
 
-def get_db_connection():
-    """Get PostgreSQL connection from Supabase"""
-    SUPABASE_DB_URL = os.environ.get('SUPABASE_DB_URL')
-    
-    if not SUPABASE_DB_URL:
-        raise Exception("No database credentials found. Set DATABASE_URL or SUPABASE_DB_HOST + SUPABASE_DB_PASSWORD")
-    
-    try:
-        conn = psycopg2.connect(SUPABASE_DB_URL)
+class ConnectionPool:
+    """Thread-safe pool of PostgreSQL connections.
+
+    Connections are health-checked on checkout, recycled once they pass
+    ``max_lifetime`` seconds and discarded when returned in a broken state.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, max_lifetime=1800,
+                 timeout=10, check_idle=30, name='primary'):
+        self.dsn = dsn
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._idle = collections.deque()   # (conn, created_at, returned_at)
+        self._born = {}                    # id(conn) -> created_at
+        self._inherited = []               # a parent's connections, never closed here
+        self._size = 0                     # open connections + reserved slots
+        self._lock = threading.Condition()
+        self._pid = os.getpid()
+        for _ in range(min_size):
+            self._size += 1
+            conn = self._connect()
+            self._idle.append((conn, self._born[id(conn)], time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=InstrumentedConnection)
+        conn.db_target = self.name
+        self._born[id(conn)] = time.monotonic()
         return conn
-    except Exception as e:
-        print(f"❌ Database connection failed: {e}")
-        raise
+
+    def _close(self, conn):
+        if self._born.pop(id(conn), None) is not None:
+            self._size -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, created_at, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - created_at > self.max_lifetime:
+            return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        # Only ping connections that sat idle long enough to have been dropped
+        if time.monotonic() - returned_at > self.check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def _check_fork(self):
+        # Connections must never be shared across a gunicorn fork. The
+        # inherited ones stay referenced: freeing one would close it, and
+        # psycopg2 would end the parent's session over the shared socket.
+        if self._pid != os.getpid():
+            self._inherited.extend(conn for conn, _, _ in self._idle)
+            self._idle.clear()
+            self._born.clear()
+            self._size = 0
+            self._pid = os.getpid()
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                self._check_fork()
+                conn = None
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Exception(f"Timed out waiting for a database connection (pool size {self.max_size})")
+                    self._lock.wait(remaining)
+                if self._idle:
+                    conn, created_at, returned_at = self._idle.pop()
+                else:
+                    self._size += 1
+            if conn is None:
+                break
+            # Checked outside the lock, so a slow ping holds up only this caller
+            if self._healthy(conn, created_at, returned_at):
+                return conn
+            with self._lock:
+                self._close(conn)
+                self._lock.notify()
+        try:
+            conn = psycopg2.connect(self.dsn, connection_factory=InstrumentedConnection)
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+        conn.db_target = self.name
+        with self._lock:
+            self._born[id(conn)] = time.monotonic()
+        return conn
+
+    def putconn(self, conn, discard=False):
+        with self._lock:
+            if id(conn) not in self._born:
+                # Opened before a fork (kept alive, see _check_fork), or
+                # already discarded
+                if not conn.closed and self._pid == os.getpid():
+                    self._inherited.append(conn)
+                return
+            if not discard and not conn.closed:
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+            if discard or conn.closed:
+                self._close(conn)
+            else:
+                self._idle.append((conn, self._born[id(conn)], time.monotonic()))
+            self._lock.notify()
+
+    def closeall(self):
+        with self._lock:
+            while self._idle:
+                self._close(self._idle.pop()[0])
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def pool_settings():
+    """ConnectionPool options from the environment (shared by replica pools)"""
+    return dict(
+        max_size=int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+        max_lifetime=float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+        timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        check_idle=float(os.environ.get('DB_POOL_CHECK_IDLE', 30)),
+    )
+
+def get_pool():
+    """Create the process-wide connection pool on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                SUPABASE_DB_URL = os.environ.get('SUPABASE_DB_URL')
+
+                if not SUPABASE_DB_URL:
+                    raise Exception("No database credentials found. Set DATABASE_URL or SUPABASE_DB_HOST + SUPABASE_DB_PASSWORD")
+
+                try:
+                    _pool = ConnectionPool(
+                        SUPABASE_DB_URL,
+                        min_size=int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+                        **pool_settings()
+                    )
+                except Exception as e:
+                    print(f"❌ Database connection failed: {e}")
+                    raise
+    return _pool
+
+def get_db_connection():
+    """Get the pooled PostgreSQL connection for the current request.
+
+    The first call inside an app context borrows a connection from the pool;
+    every later call in the same request reuses it. It is returned to the pool
+    in ``release_db_connection`` when the app context tears down, so callers
+    must not close it.
+    """
+    if 'db_conn' not in g:
+        start = time.perf_counter()
+        g.db_conn = get_pool().getconn()
+        elapsed = time.perf_counter() - start
+        metrics.observe('db_connection_acquire_seconds', elapsed)
+        record_timing('db_acquire', elapsed)
+    return g.db_conn
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    """Return the request's connections to their pools, recycling them on error"""
+    discard = isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError))
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        get_pool().putconn(conn, discard=discard)
+    replica = g.pop('db_read_replica', None)
+    conn = g.pop('db_read_conn', None)
+    if conn is not None:
+        # Handlers catch their own errors, so also look at the connection
+        lost = discard or bool(conn.closed)
+        replica.pool.putconn(conn, discard=lost)
+        if lost:
+            replica_router.take_out(replica, 'connection_lost', str(exc) if exc else None)
+
+def rollback_db_connection():
+    """Clear an aborted transaction so later queries in the request still work"""
+    for conn in (g.get('db_conn'), g.get('db_read_conn')):
+        if conn is not None and not conn.closed:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+
+# ============================================
+# READ REPLICAS
+# ============================================
+
+# DB_REPLICA_URLS is a comma-separated list of standby DSNs (add
+# connect_timeout=2 or so, so a dead host fails fast). A local pair:
+#
+#   pg_basebackup -h <primary socket dir> -D /tmp/replica -R -X stream
+#   postgres -D /tmp/replica -k /tmp/replica -p 5433
+#   DB_REPLICA_URLS='postgresql://postgres@/postgres?host=/tmp/replica&port=5433'
+
+# A replica is a streaming standby: in recovery, and behind by the time
+# since its last replayed transaction unless it has replayed all it received
+REPLICA_LAG_SQL = """
+    SELECT pg_is_in_recovery(),
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                     AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+                THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+           END
+"""
+
+class Replica:
+    """One read replica: its connection pool and last observed health"""
+
+    def __init__(self, name, dsn):
+        self.name = name
+        self.pool = ConnectionPool(dsn, min_size=0, name=name, **pool_settings())
+        self.healthy = False     # until the first check passes
+        self.lag = None
+        self.error = None
+
+class ReplicaRouter:
+    """Routes read-only queries to healthy replicas.
+
+    A checker thread per process measures every replica each ``interval``
+    seconds; one that is unreachable, not in recovery or more than
+    ``max_lag`` seconds behind leaves the rotation until a later check
+    passes, and its reads go to the primary meanwhile. A replica whose
+    connection fails mid-request is taken out straight away.
+    """
+
+    def __init__(self, dsns, max_lag=5, interval=5):
+        self.replicas = [Replica(f"replica{i}", dsn) for i, dsn in enumerate(dsns)]
+        self.max_lag = max_lag
+        self.interval = interval
+        self._turn = 0
+        self._checker_pid = None
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """Next healthy replica (round robin), or None"""
+        self._ensure_checker()
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return None
+        self._turn += 1
+        return healthy[self._turn % len(healthy)]
+
+    def take_out(self, replica, reason, error=None):
+        if replica.healthy:
+            print(f"Replica {replica.name} out of rotation ({reason})" + (f": {error}" if error else ""))
+            metrics.inc('db_replica_failovers_total', target=replica.name, reason=reason)
+        replica.healthy = False
+        replica.error = error or reason
+
+    def check(self, replica):
+        try:
+            conn = replica.pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(REPLICA_LAG_SQL)
+                    in_recovery, lag = cur.fetchone()
+                replica.pool.putconn(conn)
+            except Exception:
+                replica.pool.putconn(conn, discard=True)
+                raise
+        except Exception as e:
+            replica.lag = None
+            self.take_out(replica, 'unreachable', str(e).strip())
+            return
+        replica.lag = float(lag) if lag is not None else None
+        if not in_recovery:
+            self.take_out(replica, 'not_in_recovery')
+        elif replica.lag is None or replica.lag > self.max_lag:
+            self.take_out(replica, 'lag', f"{replica.lag}s behind")
+        else:
+            if not replica.healthy:
+                print(f"Replica {replica.name} in rotation ({replica.lag:.1f}s behind)")
+            replica.healthy = True
+            replica.error = None
+
+    def check_all(self):
+        for replica in self.replicas:
+            self.check(replica)
+
+    def stats(self):
+        return [{"name": r.name, "healthy": r.healthy, "lag_seconds": r.lag, "error": r.error}
+                for r in self.replicas]
+
+    def _ensure_checker(self):
+        if self._checker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._checker_pid = os.getpid()
+            # Health seen by the parent says nothing about this process's pools
+            for replica in self.replicas:
+                replica.healthy = False
+        threading.Thread(target=self._check_forever, name='replica-checker', daemon=True).start()
+
+    def _check_forever(self):
+        while True:
+            self.check_all()
+            time.sleep(self.interval)
+
+
+REPLICA_DSNS = [dsn.strip() for dsn in os.environ.get('DB_REPLICA_URLS', '').split(',') if dsn.strip()]
+replica_router = ReplicaRouter(
+    REPLICA_DSNS,
+    max_lag=float(os.environ.get('DB_REPLICA_MAX_LAG', 5)),
+    interval=float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 5)),
+) if REPLICA_DSNS else None
+
+# After a write, a client reads from the primary for this long, which covers
+# the most a replica in rotation can be behind
+PRIMARY_STICKY_SECONDS = float(os.environ.get(
+    'DB_PRIMARY_STICKY_SECONDS',
+    replica_router.max_lag + replica_router.interval if replica_router else 0))
+PRIMARY_STICKY_COOKIE = 'db_primary_until'
+
+def reads_stick_to_primary():
+    """Whether this request's client wrote recently (see stick_to_primary)"""
+    try:
+        return float(request.cookies.get(PRIMARY_STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def get_read_connection():
+    """Connection for read-only queries in the current request.
+
+    A replica for GET requests when one is configured and healthy; the
+    primary (``get_db_connection``) for everything else, for clients that
+    wrote within the last PRIMARY_STICKY_SECONDS, and once the request has
+    already used the primary. Never write through it.
+    """
+    if 'db_read_conn' in g:
+        return g.db_read_conn
+    if replica_router is None or 'db_conn' in g or not has_request_context() \
+            or request.method not in ('GET', 'HEAD') or reads_stick_to_primary():
+        metrics.inc('db_reads_total', target='primary')
+        return get_db_connection()
+    replica = replica_router.choose()
+    if replica is not None:
+        start = time.perf_counter()
+        try:
+            conn = replica.pool.getconn()
+        except Exception as e:
+            replica_router.take_out(replica, 'unreachable', str(e).strip())
+        else:
+            elapsed = time.perf_counter() - start
+            metrics.observe('db_connection_acquire_seconds', elapsed)
+            record_timing('db_acquire', elapsed)
+            metrics.inc('db_reads_total', target=replica.name)
+            g.db_read_replica = replica
+            g.db_read_conn = conn
+            return conn
+    metrics.inc('db_reads_total', target='primary')
+    return get_db_connection()
+
+@app.after_request
+def stick_to_primary(response):
+    """Send a client's reads to the primary for a while after it writes"""
+    if replica_router is not None and request.method not in ('GET', 'HEAD', 'OPTIONS') \
+            and response.status_code < 400:
+        # The value decides; max_age only lets the browser drop it afterwards
+        response.set_cookie(PRIMARY_STICKY_COOKIE, f"{time.time() + PRIMARY_STICKY_SECONDS:.3f}",
+                            max_age=int(PRIMARY_STICKY_SECONDS) + 1, httponly=True, samesite='Lax')
+    return response
 
 from psycopg2.extras import RealDictCursor, Json
 
+# Idempotent DDL for objects the app manages itself. The base tables
+# (settings, invoices, services) are still created manually in Supabase.
+SCHEMA_STATEMENTS = [
+    # Quote numbers come from a sequence so allocation is folded into the
+    # INSERT; it is seeded from the legacy company_settings counter.
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('quote_number_seq') IS NULL THEN
+            EXECUTE format('CREATE SEQUENCE quote_number_seq START %s', COALESCE(
+                (SELECT (value->>'next_quote_number')::bigint FROM settings WHERE key = 'company_settings'),
+                5401));
+        END IF;
+    END $$;
+    """,
+    # Keyset pagination and prefix filters for GET /api/invoices
+    "CREATE INDEX IF NOT EXISTS invoices_created_at_id_idx ON invoices (created_at DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS invoices_client_name_prefix_idx ON invoices (lower(client_name) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS invoices_quote_number_prefix_idx ON invoices (quote_number text_pattern_ops)",
+    # Full-text search (GET /api/invoices/search). The vector is a generated
+    # column, so every write path keeps it current; 'simple' because client
+    # names, quote numbers and trade terms don't stem.
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = 'invoices'::regclass
+                       AND attname = 'search_vector' AND NOT attisdropped) THEN
+            ALTER TABLE invoices ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple'::regconfig,
+                    COALESCE(quote_number, '') || ' ' || COALESCE(client_name, '')), 'A') ||
+                setweight(to_tsvector('simple'::regconfig, COALESCE(client_number, '')), 'B') ||
+                setweight(jsonb_to_tsvector('simple'::regconfig,
+                    jsonb_path_query_array(COALESCE(items::jsonb, '[]'), '$[*].name'), '["string"]'), 'B') ||
+                setweight(to_tsvector('simple'::regconfig, COALESCE(project_notes, '')), 'C') ||
+                setweight(jsonb_to_tsvector('simple'::regconfig,
+                    jsonb_path_query_array(COALESCE(items::jsonb, '[]'), '$[*].notes'), '["string"]'), 'D')
+            ) STORED;
+        END IF;
+    END $$;
+    """,
+    "CREATE INDEX IF NOT EXISTS invoices_search_vector_idx ON invoices USING gin (search_vector)",
+    # Fuzzy matching needs pg_trgm; search falls back to full text alone
+    # where the extension can't be installed
+    """
+    DO $$
+    BEGIN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    EXCEPTION WHEN OTHERS THEN
+        RAISE NOTICE 'pg_trgm unavailable (%), fuzzy invoice search disabled', SQLERRM;
+    END $$;
+    """,
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+            CREATE INDEX IF NOT EXISTS invoices_client_name_trgm_idx ON invoices USING gin (client_name gin_trgm_ops);
+            CREATE INDEX IF NOT EXISTS invoices_client_number_trgm_idx ON invoices USING gin (client_number gin_trgm_ops);
+            CREATE INDEX IF NOT EXISTS invoices_quote_number_trgm_idx ON invoices USING gin (quote_number gin_trgm_ops);
+        END IF;
+    END $$;
+    """,
+    # Typed line items. invoice_id takes the type of invoices.id; existing
+    # JSON items are copied in when the table is first created, and
+    # ensure_schema then fills in their service keys from the catalog.
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('invoice_items') IS NULL THEN
+            EXECUTE format($ddl$
+                CREATE TABLE invoice_items (
+                    invoice_id %s NOT NULL REFERENCES invoices (id) ON DELETE CASCADE,
+                    position integer NOT NULL,
+                    catalog_id text,
+                    service_key text,
+                    name text NOT NULL,
+                    quantity numeric(12, 3) NOT NULL DEFAULT 0,
+                    unit text,
+                    price numeric(12, 2) NOT NULL DEFAULT 0,
+                    line_total numeric(14, 2) NOT NULL DEFAULT 0,
+                    notes text,
+                    extra jsonb,
+                    PRIMARY KEY (invoice_id, position)
+                )$ddl$, (SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+                         WHERE attrelid = 'invoices'::regclass AND attname = 'id'));
+
+            INSERT INTO invoice_items (invoice_id, position, catalog_id, name, quantity,
+                                       unit, price, line_total, notes, extra)
+            SELECT i.id, e.ordinality - 1, e.item->>'id',
+                   COALESCE(e.item->>'name', e.item->>'service', 'Unknown Item'),
+                   COALESCE(NULLIF(e.item->>'quantity', '')::numeric, 0), e.item->>'unit',
+                   COALESCE(NULLIF(e.item->>'price', '')::numeric, 0),
+                   COALESCE(NULLIF(e.item->>'total', '')::numeric, 0), e.item->>'notes',
+                   NULLIF(e.item - ARRAY['id', 'name', 'quantity', 'unit', 'price', 'total', 'notes'], '{}'::jsonb)
+            FROM invoices i,
+                 jsonb_array_elements(CASE WHEN jsonb_typeof(i.items) = 'array' THEN i.items ELSE '[]' END)
+                     WITH ORDINALITY AS e(item, ordinality);
+        END IF;
+    END $$;
+    """,
+    "CREATE INDEX IF NOT EXISTS invoice_items_service_key_idx ON invoice_items (service_key)",
+    # Reporting rollups, kept current by the statement triggers and
+    # report_fold() below, and backfilled from the base tables when first
+    # created
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('report_monthly') IS NULL THEN
+            LOCK TABLE invoices, invoice_items IN SHARE ROW EXCLUSIVE MODE;
+            CREATE TABLE report_monthly (
+                month date PRIMARY KEY,
+                invoice_count bigint NOT NULL DEFAULT 0,
+                revenue numeric(16, 2) NOT NULL DEFAULT 0,
+                gst numeric(16, 2) NOT NULL DEFAULT 0
+            );
+            CREATE TABLE report_clients (
+                client_name text PRIMARY KEY,
+                invoice_count bigint NOT NULL DEFAULT 0,
+                revenue numeric(16, 2) NOT NULL DEFAULT 0
+            );
+            CREATE TABLE report_services (
+                service_key text PRIMARY KEY,
+                line_count bigint NOT NULL DEFAULT 0,
+                quantity numeric(16, 3) NOT NULL DEFAULT 0,
+                revenue numeric(16, 2) NOT NULL DEFAULT 0
+            );
+            INSERT INTO report_monthly
+            SELECT date_trunc('month', created_at::timestamptz AT TIME ZONE 'Australia/Sydney')::date,
+                   count(*), COALESCE(sum(total::numeric), 0), COALESCE(sum(round(total::numeric * 0.1, 2)), 0)
+            FROM invoices GROUP BY 1;
+            INSERT INTO report_clients
+            SELECT COALESCE(trim(client_name), ''), count(*), COALESCE(sum(total::numeric), 0)
+            FROM invoices GROUP BY 1;
+            INSERT INTO report_services
+            SELECT COALESCE(service_key, ''), count(*), sum(quantity), sum(line_total)
+            FROM invoice_items GROUP BY 1;
+        END IF;
+    END $$;
+    """,
+    # Writers only append to these; report_fold() moves them into the
+    # rollups, so concurrent writes never queue on a shared rollup row
+    """
+    CREATE TABLE IF NOT EXISTS report_invoice_deltas (
+        month date NOT NULL,
+        client_name text NOT NULL,
+        invoice_count bigint NOT NULL,
+        revenue numeric(16, 2) NOT NULL,
+        gst numeric(16, 2) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS report_item_deltas (
+        service_key text NOT NULL,
+        line_count bigint NOT NULL,
+        quantity numeric(16, 3) NOT NULL,
+        revenue numeric(16, 2) NOT NULL
+    )
+    """,
+    # Statement-level so a multi-row write appends one delta row per key.
+    # Each trigger sees only the transition tables its event provides.
+    """
+    CREATE OR REPLACE FUNCTION report_invoices_rollup() RETURNS trigger LANGUAGE plpgsql AS $fn$
+    DECLARE
+        delta text := concat_ws(' UNION ALL ',
+            CASE WHEN TG_OP <> 'DELETE' THEN 'SELECT created_at, client_name, total, 1 AS sign FROM new_rows' END,
+            CASE WHEN TG_OP <> 'INSERT' THEN 'SELECT created_at, client_name, total, -1 AS sign FROM old_rows' END);
+    BEGIN
+        EXECUTE format($sql$
+            INSERT INTO report_invoice_deltas
+            SELECT month, client_name, sum(sign), sum(sign * total), sum(sign * round(total * 0.1, 2))
+            FROM (
+                SELECT date_trunc('month', created_at::timestamptz AT TIME ZONE 'Australia/Sydney')::date AS month,
+                       COALESCE(trim(client_name), '') AS client_name,
+                       COALESCE(total::numeric, 0) AS total, sign
+                FROM (%s) delta
+            ) d
+            GROUP BY month, client_name
+            HAVING sum(sign) <> 0 OR sum(sign * total) <> 0
+        $sql$, delta);
+        RETURN NULL;
+    END $fn$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION report_items_rollup() RETURNS trigger LANGUAGE plpgsql AS $fn$
+    DECLARE
+        delta text := concat_ws(' UNION ALL ',
+            CASE WHEN TG_OP <> 'DELETE' THEN 'SELECT service_key, quantity, line_total, 1 AS sign FROM new_rows' END,
+            CASE WHEN TG_OP <> 'INSERT' THEN 'SELECT service_key, quantity, line_total, -1 AS sign FROM old_rows' END);
+    BEGIN
+        EXECUTE format($sql$
+            INSERT INTO report_item_deltas
+            SELECT COALESCE(service_key, ''), sum(sign), sum(sign * quantity), sum(sign * line_total)
+            FROM (%s) delta GROUP BY 1
+            HAVING sum(sign) <> 0 OR sum(sign * line_total) <> 0
+        $sql$, delta);
+        RETURN NULL;
+    END $fn$
+    """,
+    # Folds committed deltas into the rollups in one transaction, so readers
+    # of the *_live views below never count a delta twice. One folder at a
+    # time; the others skip.
+    """
+    CREATE OR REPLACE FUNCTION report_fold() RETURNS void LANGUAGE plpgsql AS $fn$
+    BEGIN
+        IF NOT pg_try_advisory_xact_lock(hashtext('report_fold')) THEN
+            RETURN;
+        END IF;
+        WITH moved AS (
+            DELETE FROM report_invoice_deltas RETURNING *
+        ), monthly AS (
+            INSERT INTO report_monthly AS r
+            SELECT month, sum(invoice_count), sum(revenue), sum(gst)
+            FROM moved GROUP BY month
+            ON CONFLICT (month) DO UPDATE
+            SET invoice_count = r.invoice_count + excluded.invoice_count,
+                revenue = r.revenue + excluded.revenue,
+                gst = r.gst + excluded.gst
+        )
+        INSERT INTO report_clients AS r
+        SELECT client_name, sum(invoice_count), sum(revenue)
+        FROM moved GROUP BY client_name
+        ON CONFLICT (client_name) DO UPDATE
+        SET invoice_count = r.invoice_count + excluded.invoice_count,
+            revenue = r.revenue + excluded.revenue;
+        WITH moved AS (
+            DELETE FROM report_item_deltas RETURNING *
+        )
+        INSERT INTO report_services AS r
+        SELECT service_key, sum(line_count), sum(quantity), sum(revenue)
+        FROM moved GROUP BY service_key
+        ON CONFLICT (service_key) DO UPDATE
+        SET line_count = r.line_count + excluded.line_count,
+            quantity = r.quantity + excluded.quantity,
+            revenue = r.revenue + excluded.revenue;
+    END $fn$
+    """,
+    # What the reports read: the rollups plus deltas not yet folded in
+    """
+    CREATE OR REPLACE VIEW report_monthly_live AS
+    SELECT month, sum(invoice_count)::bigint AS invoice_count, sum(revenue) AS revenue, sum(gst) AS gst
+    FROM (SELECT month, invoice_count, revenue, gst FROM report_monthly
+          UNION ALL
+          SELECT month, invoice_count, revenue, gst FROM report_invoice_deltas) r
+    GROUP BY month
+    """,
+    """
+    CREATE OR REPLACE VIEW report_clients_live AS
+    SELECT client_name, sum(invoice_count)::bigint AS invoice_count, sum(revenue) AS revenue
+    FROM (SELECT client_name, invoice_count, revenue FROM report_clients
+          UNION ALL
+          SELECT client_name, invoice_count, revenue FROM report_invoice_deltas) r
+    GROUP BY client_name
+    """,
+    """
+    CREATE OR REPLACE VIEW report_services_live AS
+    SELECT service_key, sum(line_count)::bigint AS line_count, sum(quantity) AS quantity, sum(revenue) AS revenue
+    FROM (SELECT service_key, line_count, quantity, revenue FROM report_services
+          UNION ALL
+          SELECT service_key, line_count, quantity, revenue FROM report_item_deltas) r
+    GROUP BY service_key
+    """,
+    """
+    DO $$
+    DECLARE
+        source text;
+        fn text;
+    BEGIN
+        FOREACH source IN ARRAY ARRAY['invoices', 'invoice_items'] LOOP
+            fn := CASE source WHEN 'invoices' THEN 'report_invoices_rollup' ELSE 'report_items_rollup' END;
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = source::regclass AND tgname = source || '_report_insert') THEN
+                EXECUTE format('CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows '
+                               'FOR EACH STATEMENT EXECUTE FUNCTION %I()', source || '_report_insert', source, fn);
+                EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+                               'FOR EACH STATEMENT EXECUTE FUNCTION %I()', source || '_report_update', source, fn);
+                EXECUTE format('CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows '
+                               'FOR EACH STATEMENT EXECUTE FUNCTION %I()', source || '_report_delete', source, fn);
+            END IF;
+        END LOOP;
+    END $$;
+    """,
+    # Queue for asynchronous PDF renders (see pdf_worker.py)
+    """
+    CREATE TABLE IF NOT EXISTS pdf_jobs (
+        id uuid PRIMARY KEY,
+        invoice_id text NOT NULL,
+        status text NOT NULL DEFAULT 'queued',
+        error text,
+        result bytea,
+        created_at timestamptz NOT NULL DEFAULT now(),
+        started_at timestamptz,
+        finished_at timestamptz
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS pdf_jobs_status_idx ON pdf_jobs (status, created_at)",
+]
+
+def backfill_item_service_keys(cur):
+    """Resolve service_key for copied-in legacy line items the way
+    normalize_items does for new ones, so reports keep their attribution.
+    Runs after the rollup triggers exist, so report_services follows."""
+    cur.execute("SELECT value FROM settings WHERE key = 'services'")
+    row = cur.fetchone()
+    catalog = ServiceCatalog(row[0] if row and row[0] else DEFAULT_SERVICES, None)
+    cur.execute("SELECT DISTINCT catalog_id FROM invoice_items WHERE catalog_id IS NOT NULL AND service_key IS NULL")
+    keys = [(ref, catalog.resolve(ref)) for (ref,) in cur.fetchall()]
+    keys = [(ref, key) for ref, key in keys if key]
+    if keys:
+        execute_values(cur, """
+            UPDATE invoice_items SET service_key = v.key
+            FROM (VALUES %s) AS v (ref, key)
+            WHERE invoice_items.catalog_id = v.ref AND invoice_items.service_key IS NULL
+        """, keys)
+
+def ensure_schema(conn):
+    """Apply SCHEMA_STATEMENTS and per-deployment tuning"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('invoice_items') IS NULL")
+        new_items_table = cur.fetchone()[0]
+        for statement in SCHEMA_STATEMENTS:
+            cur.execute(statement)
+        if new_items_table:
+            backfill_item_service_keys(cur)
+        # Each pooled connection reserves this many quote numbers at a time
+        cur.execute("ALTER SEQUENCE quote_number_seq CACHE %s",
+                    (int(os.environ.get('QUOTE_NUMBER_BLOCK', 1)),))
+    conn.commit()
+
 def init_database():
     """Verify database connection and that 'services' table exists."""
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_name = 'services'
-                );
-            """)
-            exists = cur.fetchone()[0]
+        with app.app_context():
+            conn = get_db_connection()
+            ensure_schema(conn)
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT EXISTS (
+                        SELECT FROM information_schema.tables 
+                        WHERE table_name = 'services'
+                    );
+                """)
+                exists = cur.fetchone()[0]
 
             if not exists:
                 print("❌ Table 'services' does not exist. Please create it manually.")
             else:
                 print("✅ Database ready. Using existing 'services' table.")
+            return True
 
     except Exception as e:
         print(f"❌ Database init failed: {e}")
+        return False
 
-# Initialize database on startup
-try:
-    init_database()
-except Exception as e:
-    print(f"❌ FATAL: Cannot start without database: {e}")
-    import sys
-    sys.exit(1)
+# Seconds spent in each startup phase of this process, exported on /metrics
+STARTUP_SECONDS = {}
+DB_CHECK_RETRY_SECONDS = float(os.environ.get('DB_CHECK_RETRY_SECONDS', 5))
+
+# How often each process folds pending report deltas into the rollups
+REPORT_FOLD_SECONDS = float(os.environ.get('REPORT_FOLD_SECONDS', 30))
+
+def fold_report_deltas():
+    """Move committed rollup deltas into the report tables (see report_fold)"""
+    with app.app_context():
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT report_fold()")
+        conn.commit()
+
+def fold_reports_forever():
+    while True:
+        try:
+            fold_report_deltas()
+        except Exception as e:
+            print(f"Error folding report deltas: {e}")
+        time.sleep(REPORT_FOLD_SECONDS)
+
+_db_ready = threading.Event()
+_db_check_pid = None
+_db_check_lock = threading.Lock()
+
+def start_database_check():
+    """Run init_database on a background thread, retrying until it succeeds.
+
+    Importing the app no longer blocks on (or exits over) the database; the
+    check starts with create_app or the first request of each process, and
+    /ready answers 503 until it has passed.
+    """
+    global _db_check_pid
+    if _db_check_pid == os.getpid() or _db_ready.is_set():
+        return
+    with _db_check_lock:
+        if _db_check_pid == os.getpid():
+            return
+        _db_check_pid = os.getpid()
+
+    def check():
+        started = time.perf_counter()
+        while not init_database():
+            time.sleep(DB_CHECK_RETRY_SECONDS)
+        STARTUP_SECONDS['database'] = time.perf_counter() - started
+        _db_ready.set()
+        threading.Thread(target=fold_reports_forever, name='report-fold', daemon=True).start()
+
+    threading.Thread(target=check, name='db-check', daemon=True).start()
+
+@app.before_request
+def ensure_database_check():
+    start_database_check()
 
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
 
+class SettingsCache:
+    """In-process cache for rows of the ``settings`` table.
+
+    Entries expire after ``ttl`` seconds. ``set_setting`` invalidates the key
+    locally and sends ``NOTIFY settings_changed`` so a listener thread in every
+    other worker drops its copy as soon as the write commits. Cached values are
+    shared between requests and must be treated as read-only.
+    """
+
+    CHANNEL = 'settings_changed'
+
+    def __init__(self, ttl=300, listen=True):
+        self.ttl = ttl
+        self.listen = listen
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = {}       # key -> (value, version, expires_at)
+        self._generation = 0     # bumped on every invalidation
+        self._invalidated_at = {}  # key (None: everything) -> monotonic time
+        self._lock = threading.Lock()
+        self._listener_pid = None
+        self.listening = False
+
+    def get(self, key):
+        """Return ``(found, value, version)`` for a live cache entry"""
+        self._ensure_listener()
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] > time.monotonic():
+            self.hits += 1
+            return True, entry[0], entry[1]
+        self.misses += 1
+        return False, None, None
+
+    def generation(self):
+        return self._generation
+
+    def put(self, key, value, version, generation):
+        """Store a value read at ``generation``, unless it was invalidated meanwhile"""
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (value, version, time.monotonic() + self.ttl)
+
+    def version(self, key):
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def changed_within(self, key, seconds):
+        """Whether ``key`` (or every key) was invalidated in the last ``seconds``"""
+        now = time.monotonic()
+        return any(now - self._invalidated_at[k] < seconds for k in (key, None) if k in self._invalidated_at)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._invalidated_at[key or None] = time.monotonic()
+            if key:
+                self._entries.pop(key, None)
+            else:
+                self._entries.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "listening": self.listening,
+        }
+
+    def _ensure_listener(self):
+        if not self.listen or self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            # A forked worker must not trust entries cached by its parent
+            self._entries.clear()
+        threading.Thread(target=self._listen_forever, name='settings-listener', daemon=True).start()
+
+    def _listen_forever(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(get_pool().dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.CHANNEL}")
+                # Anything may have changed while we were not listening
+                self.invalidate()
+                self.listening = True
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.invalidate(conn.notifies.pop(0).payload or None)
+            except Exception as e:
+                print(f"Settings cache listener error: {e}")
+            finally:
+                self.listening = False
+                if conn is not None:
+                    conn.close()
+            time.sleep(5)
+
+
+settings_cache = SettingsCache(
+    ttl=float(os.environ.get('SETTINGS_CACHE_TTL', 300)),
+    listen=os.environ.get('SETTINGS_CACHE_LISTEN', '1') != '0',
+)
+
 def get_setting(key, default_value):
-    """Get setting from database"""
+    """Get setting from the settings cache, falling back to the database"""
+    return get_setting_with_version(key, default_value)[0]
+
+def get_setting_with_version(key, default_value):
+    """``(value, version)`` for a setting; version is its updated_at as text,
+    or None when the default is returned"""
+    found, value, version = settings_cache.get(key)
+    if found:
+        return (default_value, None) if value is None else (value, version)
+
     try:
-        conn = get_db_connection()
-        cursor = cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT value FROM settings WHERE key = %s", (key,))
+        generation = settings_cache.generation()
+        # A value that just changed may not have reached the replicas yet
+        if settings_cache.changed_within(key, PRIMARY_STICKY_SECONDS):
+            conn = get_db_connection()
+        else:
+            conn = get_read_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT value, updated_at FROM settings WHERE key = %s", (key,))
         row = cursor.fetchone()
         cursor.close()
-        conn.close()
         
         if row:
-            return row['value']
-        return default_value
+            settings_cache.put(key, row['value'], str(row['updated_at']), generation)
+            return row['value'], str(row['updated_at'])
+        settings_cache.put(key, None, None, generation)
+        return default_value, None
         
     except Exception as e:
         print(f"Error fetching {key} from DB: {e}")
-        return default_value
+        rollback_db_connection()
+        return default_value, None
 
 def set_setting(key, value):
-    """Set setting in database"""
+    """Set setting in database and invalidate it in every worker's cache"""
     try:
         conn = get_db_connection()
-        cursor = cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
         cursor.execute("""
             INSERT INTO settings (key, value, updated_at)
             VALUES (%s, %s, %s)
             ON CONFLICT (key) 
             DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
         """, (key, Json(value), datetime.now().isoformat()))
+        cursor.execute("SELECT pg_notify(%s, %s)", (SettingsCache.CHANNEL, key))
         conn.commit()
         cursor.close()
-        conn.close()
+        settings_cache.invalidate(key)
         return True
     except Exception as e:
         print(f"Error saving {key} to DB: {e}")
+        rollback_db_connection()
         return False
 
+def sydney_now():
+    """Current time in Australia/Sydney (pytz is imported on first use)"""
+    import pytz
+    return datetime.now(pytz.timezone('Australia/Sydney'))
+
+# Cache key for the peeked quote sequence; invalidated locally on create
+QUOTE_COUNTER_KEY = 'quote_number_seq'
+
+def get_next_quote_number():
+    """Next number quote_number_seq will hand out (cached like a setting).
+
+    For display only: the cache can be stale in other workers, so anything
+    that moves the sequence decides against it in SQL instead.
+    """
+    found, value, _ = settings_cache.get(QUOTE_COUNTER_KEY)
+    if found:
+        return value
+
+    generation = settings_cache.generation()
+    # Always the primary: a standby's copy of a sequence can run ahead of it
+    conn = get_db_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT last_value, is_called FROM quote_number_seq")
+        last_value, is_called = cursor.fetchone()
+    next_number = last_value + 1 if is_called else last_value
+    settings_cache.put(QUOTE_COUNTER_KEY, next_number, None, generation)
+    return next_number
+
+def set_next_quote_number(next_number):
+    """Restart quote_number_seq; the caller commits"""
+    conn = get_db_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT setval('quote_number_seq', %s, false)", (next_number,))
+    settings_cache.invalidate(QUOTE_COUNTER_KEY)
+
+def raise_next_quote_number(next_number):
+    """Move quote_number_seq up to ``next_number``, never down; the caller commits.
+
+    The comparison runs against the live sequence in the same statement, so
+    numbers already handed out (by any worker) are never reissued. Returns
+    whether the sequence moved.
+    """
+    conn = get_db_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT setval('quote_number_seq', %s, false)
+            WHERE %s > (SELECT CASE WHEN is_called THEN last_value + 1 ELSE last_value END
+                        FROM quote_number_seq)
+        """, (next_number, next_number))
+        moved = cursor.fetchone() is not None
+    settings_cache.invalidate(QUOTE_COUNTER_KEY)
+    return moved
+
+# ============================================
+# STATIC ASSETS
+# ============================================
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only without it
+    brotli = None
+
+# Served with compressed variants; everything else is sent as-is
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'application/manifest+json', 'image/svg+xml')
+ASSET_TYPES = {'.js': 'text/javascript', '.json': 'application/json',
+               '.webmanifest': 'application/manifest+json'}
+
+def negotiate_encoding(available):
+    """Best of ``available`` content-codings the client accepts, or None"""
+    accepted = request.accept_encodings
+    for coding in ('br', 'gzip'):
+        if coding in available and accepted[coding]:
+            return coding
+    return None
+
+class StaticAssets:
+    """In-memory build of static/: hashed URLs plus gzip/brotli variants.
+
+    Files are read once per process. References to ``/static/<file>`` in the
+    text assets (index.html, manifest.json, sw.js) are rewritten to the
+    file's ``/assets/<stem>.<hash><ext>`` URL, so those can be cached
+    immutably, and a changed logo also changes the service worker. The hash
+    is taken over the body as served, so an asset is built after the ones
+    it references; a reference back into a cycle keeps its /static/ URL.
+    """
+
+    def __init__(self, root):
+        self.files = {}      # logical name -> (mimetype, etag, {coding: body})
+        self.by_url = {}     # /assets/... -> logical name
+        self.urls = {}       # /static/... -> /assets/...
+        self._raw = {}
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and not name.startswith('.'):
+                with open(path, 'rb') as f:
+                    self._raw[name] = f.read()
+        for name in self._raw:
+            self._build(name, set())
+        del self._raw
+
+    def _build(self, name, resolving):
+        if name in self.files:
+            return
+        resolving.add(name)
+        body = self._raw[name]
+        mimetype = ASSET_TYPES.get(os.path.splitext(name)[1]) or \
+            mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if mimetype.startswith(COMPRESSIBLE_TYPES):
+            text = body.decode('utf-8')
+            for ref in self._raw:
+                old = f"/static/{ref}"
+                if f'"{old}"' not in text and f"'{old}'" not in text:
+                    continue
+                if ref not in resolving:
+                    self._build(ref, resolving)
+                new = self.url_for(ref)
+                text = text.replace(f'"{old}"', f'"{new}"').replace(f"'{old}'", f"'{new}'")
+            body = text.encode('utf-8')
+        resolving.discard(name)
+
+        digest = hashlib.sha256(body).hexdigest()
+        stem, ext = os.path.splitext(name)
+        url = f"/assets/{stem}.{digest[:12]}{ext}"
+        self.urls[f"/static/{name}"] = url
+        self.by_url[url] = name
+        self.files[name] = (mimetype, digest[:16], self._variants(mimetype, body))
+
+    @staticmethod
+    def _variants(mimetype, body):
+        variants = {None: body}
+        if not mimetype.startswith(COMPRESSIBLE_TYPES):
+            return variants
+        gz = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(gz) < len(body):
+            variants['gzip'] = gz
+        if brotli is not None:
+            br = brotli.compress(body, quality=11)
+            if len(br) < len(body):
+                variants['br'] = br
+        return variants
+
+    def url_for(self, name):
+        return self.urls.get(f"/static/{name}", f"/static/{name}")
+
+_static_assets = None
+_static_assets_lock = threading.Lock()
+
+def get_static_assets():
+    """The process-wide StaticAssets, built on first use (or by warm_up)"""
+    global _static_assets
+    if _static_assets is None:
+        with _static_assets_lock:
+            if _static_assets is None:
+                _static_assets = StaticAssets(app.static_folder)
+    return _static_assets
+
+def serve_asset(name, cache_control):
+    """Send a built asset with ETag/304 and the best accepted encoding"""
+    mimetype, etag, variants = get_static_assets().files[name]
+    coding = negotiate_encoding(variants)
+    # A distinct validator per representation, as the bodies differ
+    tag = f"{etag}-{coding}" if coding else etag
+    if tag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(variants[coding], mimetype=mimetype)
+        if coding:
+            response.headers['Content-Encoding'] = coding
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+# ============================================
+# JSON PROVIDER AND RESPONSE COMPRESSION
+# ============================================
+
+try:
+    import orjson
+except ImportError:  # optional; Flask's json provider without it
+    orjson = None
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+def _orjson_default(obj):
+    # orjson handles UUIDs, dataclasses and dict subclasses (RealDictRow)
+    # itself; the rest mirror DefaultJSONProvider so the output is unchanged
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, producing the same documents as
+    the default one (sorted keys, HTTP dates, Decimals as strings); only
+    non-ASCII text is written as UTF-8 rather than \\u escapes.
+
+    Rows from RealDictCursor are encoded directly, without a dict copy.
+    Anything orjson rejects (e.g. integers beyond 64 bits) goes through the
+    standard library instead.
+    """
+
+    def _options(self, indent=False):
+        options = orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumpb(self, obj, indent=False):
+        try:
+            return orjson.dumps(obj, default=_orjson_default, option=self._options(indent))
+        except (orjson.JSONEncodeError, TypeError):
+            kwargs = {"indent": 2} if indent else {"separators": (",", ":")}
+            return super().dumps(obj, **kwargs).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumpb(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumpb(obj, indent) + b"\n", mimetype=self.mimetype)
+
+if orjson is not None:
+    app.json = FastJSONProvider(app)
+
+# Dynamic responses at least this large are compressed when the client allows it
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+
+def compress_body(body, coding):
+    if coding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli for buffered text responses above COMPRESS_MIN_BYTES.
+
+    Streamed and passthrough responses (CSV exports, PDFs, files) and
+    anything already encoded are left alone.
+    """
+    if response.direct_passthrough or response.is_streamed or response.status_code in (204, 206, 304) \
+            or 'Content-Encoding' in response.headers \
+            or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES):
+        return response
+    length = response.content_length
+    if length is None or length < COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    coding = negotiate_encoding(('br', 'gzip') if brotli is not None else ('gzip',))
+    if coding is None:
+        return response
+
+    start = time.perf_counter()
+    body = compress_body(response.get_data(), coding)
+    record_timing('compress', time.perf_counter() - start)
+    if len(body) >= length:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = coding
+    # Same entity, different bytes: the validator can only be weak now
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    metrics.inc('http_compressed_bytes_saved_total', length - len(body), coding=coding)
+    return response
+
 # ============================================
 # ROUTES - MAIN
 # ============================================
 
 @app.route('/')
 def index():
-    return app.send_static_file('index.html')
+    """The HTML shell: short-lived, revalidated by ETag"""
+    return serve_asset('index.html', 'public, max-age=60')
+
+@app.route('/sw.js')
+def service_worker():
+    """Served from the root so the worker's scope covers the whole app"""
+    return serve_asset('sw.js', 'no-cache')
+
+@app.route('/manifest.json')
+def web_manifest():
+    return serve_asset('manifest.json', 'public, max-age=3600')
+
+@app.route('/assets/<name>')
+def hashed_asset(name):
+    """Content-hashed URLs from the asset manifest; safe to cache forever"""
+    assets = get_static_assets()
+    logical = assets.by_url.get(f'/assets/{name}')
+    if logical is None:
+        return jsonify({"error": "Not found"}), 404
+    return serve_asset(logical, 'public, max-age=31536000, immutable')
 
 @app.route('/health')
 def health():
     """Health check endpoint"""
     try:
         conn = get_db_connection()
-        conn.close()
-        return jsonify({"status": "healthy", "database": "connected"})
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        return jsonify({
+            "status": "healthy",
+            "database": "connected",
+            "settings_cache": settings_cache.stats(),
+            "pdf_cache": pdf_cache.stats(),
+            "replicas": replica_router.stats() if replica_router else []
+        })
     except Exception as e:
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
 
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once this process's database check has passed"""
+    if _db_ready.is_set():
+        return jsonify({"status": "ready", "startup_seconds": STARTUP_SECONDS})
+    return jsonify({"status": "starting", "startup_seconds": STARTUP_SECONDS}), 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    pool = _pool
+    extra = [
+        ('settings_cache_hits_total', 'counter', {}, settings_cache.hits),
+        ('settings_cache_misses_total', 'counter', {}, settings_cache.misses),
+        ('settings_cache_invalidations_total', 'counter', {}, settings_cache.invalidations),
+        ('pdf_cache_hits_total', 'counter', {'tier': 'memory'}, pdf_cache.hits),
+        ('pdf_cache_hits_total', 'counter', {'tier': 'disk'}, pdf_cache.disk_hits),
+        ('pdf_cache_misses_total', 'counter', {}, pdf_cache.misses),
+        ('pdf_cache_bytes', 'gauge', {}, pdf_cache.stats()['bytes']),
+    ]
+    extra += [('app_startup_seconds', 'gauge', {'phase': phase}, seconds)
+              for phase, seconds in STARTUP_SECONDS.items()]
+    pools = [pool] if pool is not None else []
+    if replica_router is not None:
+        pools += [replica.pool for replica in replica_router.replicas]
+        for replica in replica_router.replicas:
+            extra.append(('db_replica_healthy', 'gauge', {'target': replica.name}, int(replica.healthy)))
+            if replica.lag is not None:
+                extra.append(('db_replica_lag_seconds', 'gauge', {'target': replica.name}, replica.lag))
+    for target_pool in pools:
+        extra += [
+            ('db_pool_connections', 'gauge', {'state': 'open', 'target': target_pool.name}, target_pool._size),
+            ('db_pool_connections', 'gauge', {'state': 'idle', 'target': target_pool.name}, len(target_pool._idle)),
+        ]
+    return app.response_class(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
 # ============================================
 # ROUTES - SERVICES
 # ============================================
 
+DEFAULT_SERVICES = {
+    "electrician": {"name": "Electrician", "price": 85, "unit": "hour"},
+    "plumber": {"name": "Plumber", "price": 90, "unit": "hour"}
+}
+
+class ServiceCatalog:
+    """Flat index over the nested services tree.
+
+    Keys use the frontend's dot notation: ``service``, ``service.item`` or
+    ``service.category.item`` (plus ``service.category`` for categories).
+    Each key maps to the node and its JSON path inside the stored document,
+    item ids map to keys, and a sorted word list backs prefix search.
+    """
+
+    def __init__(self, tree, version):
+        self.tree = tree
+        self.version = version
+        self.by_key = {}   # key -> (json_path, node)
+        self.by_id = {}    # item id -> key
+        self._words = []   # sorted (word, key)
+        for s_key, service in tree.items():
+            if not isinstance(service, dict):
+                continue
+            self._add(s_key, [s_key], service)
+            if isinstance(service.get('categories'), dict):
+                for c_key, category in service['categories'].items():
+                    self._add(f"{s_key}.{c_key}", [s_key, 'categories', c_key], category)
+                    for i_key, item in (category.get('items') or {}).items():
+                        self._add(f"{s_key}.{c_key}.{i_key}", [s_key, 'categories', c_key, 'items', i_key], item)
+            elif isinstance(service.get('items'), dict):
+                for i_key, item in service['items'].items():
+                    self._add(f"{s_key}.{i_key}", [s_key, 'items', i_key], item)
+        self._words.sort()
+
+    def _add(self, key, path, node):
+        self.by_key[key] = (path, node)
+        if node.get('id'):
+            self.by_id[node['id']] = key
+        words = set(str(node.get('name', '')).lower().split())
+        words.add(key.rsplit('.', 1)[-1].lower())
+        for word in words:
+            self._words.append((word, key))
+
+    def resolve(self, ref):
+        """Key for a dot-notation key or an item id, or None"""
+        if ref in self.by_key:
+            return ref
+        return self.by_id.get(ref)
+
+    def search(self, query, limit=20):
+        """Entries whose name words (or leaf key) start with every query word"""
+        terms = query.lower().split()
+        if not terms:
+            return []
+        first, rest = terms[0], terms[1:]
+        found = []
+        seen = set()
+        index = bisect.bisect_left(self._words, (first,))
+        while index < len(self._words) and self._words[index][0].startswith(first):
+            key = self._words[index][1]
+            index += 1
+            if key in seen:
+                continue
+            seen.add(key)
+            node = self.by_key[key][1]
+            words = str(node.get('name', '')).lower().split() + [key.rsplit('.', 1)[-1].lower()]
+            if all(any(w.startswith(t) for w in words) for t in rest):
+                found.append(key)
+        found.sort()
+        return found[:limit]
+
+    def entry(self, key):
+        node = self.by_key[key][1]
+        # Nested children are left out; fetch them by their own keys
+        return {"key": key, **{k: v for k, v in node.items() if k not in ('categories', 'items')}}
+
+
+_catalog = None
+
+def get_catalog():
+    """ServiceCatalog for the current services tree, rebuilt when it changes"""
+    global _catalog
+    tree, version = get_setting_with_version('services', DEFAULT_SERVICES)
+    catalog = _catalog
+    if catalog is None or catalog.tree is not tree:
+        catalog = _catalog = ServiceCatalog(tree, version)
+    return catalog
+
+def services_etag(version):
+    return base64.urlsafe_b64encode(version.encode()).decode() if version else None
+
+def if_match_version():
+    """Settings version named by the request's If-Match header, if any.
+
+    Weak tags count too: compressed responses carry W/ validators. A tag
+    that is not one of our write timestamps gives '', which callers answer
+    with 412 since it can never match.
+    """
+    tags = request.if_match.as_set(include_weak=True) if request.if_match else set()
+    for tag in tags:
+        try:
+            version = base64.urlsafe_b64decode(tag.encode()).decode()
+            datetime.fromisoformat(version)
+            return version
+        except Exception:
+            return ''
+    return None
+
+def notify_services_changed(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", (SettingsCache.CHANNEL, 'services'))
+    conn.commit()
+    settings_cache.invalidate('services')
+
 @app.route('/api/services', methods=['GET'])
 def get_services():
-    """Get services from database"""
-    defaults = {
-        "electrician": {"name": "Electrician", "price": 85, "unit": "hour"},
-        "plumber": {"name": "Plumber", "price": 90, "unit": "hour"}
-    }
-    services = get_setting('services', defaults)
-    return jsonify(services)
+    """Get services from database; supports If-None-Match"""
+    services, version = get_setting_with_version('services', DEFAULT_SERVICES)
+    etag = services_etag(version)
+    if etag and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    response = jsonify(services)
+    if etag:
+        response.set_etag(etag)
+    return response
 
 @app.route('/api/services', methods=['PUT'])
 def update_services():
-    """Update services in database"""
+    """Update services in database; an If-Match header makes the write conditional"""
     services = request.json
-    success = set_setting('services', services)
-    if success:
-        return jsonify({"message": "Services updated successfully"})
-    return jsonify({"error": "Failed to update services"}), 500
+    expected = if_match_version()
+    if expected == '':
+        return jsonify({"error": "Services were changed by someone else"}), 412
+    if expected is None:
+        success = set_setting('services', services)
+        if success:
+            return jsonify({"message": "Services updated successfully"})
+        return jsonify({"error": "Failed to update services"}), 500
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            UPDATE settings SET value = %s, updated_at = %s
+            WHERE key = 'services' AND updated_at = %s
+            RETURNING updated_at
+        """, (Json(services), datetime.now().isoformat(), expected))
+        row = cursor.fetchone()
+        cursor.close()
+        if not row:
+            rollback_db_connection()
+            return jsonify({"error": "Services were changed by someone else"}), 412
+        notify_services_changed(conn)
+        response = jsonify({"message": "Services updated successfully"})
+        response.set_etag(services_etag(str(row['updated_at'])))
+        return response
+    except Exception as e:
+        print(f"Error saving services to DB: {e}")
+        return jsonify({"error": "Failed to update services"}), 500
+
+@app.route('/api/services/items/<path:ref>', methods=['GET'])
+def get_service_item(ref):
+    """Look up one service, category or item by dot-notation key or id"""
+    catalog = get_catalog()
+    key = catalog.resolve(ref)
+    if key is None:
+        return jsonify({"error": "Service item not found"}), 404
+    return jsonify(catalog.entry(key))
+
+@app.route('/api/services/search', methods=['GET'])
+def search_services():
+    """Prefix search over service, category and item names (``?q=&limit=``)"""
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    catalog = get_catalog()
+    return jsonify([catalog.entry(key) for key in catalog.search(request.args.get('q', ''), limit)])
+
+@app.route('/api/services/items/<path:ref>', methods=['PATCH'])
+def patch_service_item(ref):
+    """Merge fields into one service, category or item in place.
+
+    Only the addressed JSON path is rewritten (jsonb_set). Send the ETag from
+    GET /api/services as If-Match to reject the write if the catalog changed.
+    """
+    changes = request.json
+    if not isinstance(changes, dict) or not changes:
+        return jsonify({"error": "Body must be an object of fields to change"}), 400
+    catalog = get_catalog()
+    key = catalog.resolve(ref)
+    if key is None:
+        return jsonify({"error": "Service item not found"}), 404
+    path = catalog.by_key[key][0]
+    expected = if_match_version()
+    if expected == '':
+        return jsonify({"error": "Services were changed by someone else"}), 412
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        query = """
+            UPDATE settings
+            SET value = jsonb_set(value, %(path)s, (value #> %(path)s) || %(changes)s),
+                updated_at = %(now)s
+            WHERE key = 'services' AND value #> %(path)s IS NOT NULL
+        """
+        if expected is not None:
+            query += " AND updated_at = %(expected)s"
+        cursor.execute(query + " RETURNING value #> %(path)s AS node, updated_at", {
+            "path": path,
+            "changes": Json(changes),
+            "now": datetime.now().isoformat(),
+            "expected": expected,
+        })
+        row = cursor.fetchone()
+        cursor.close()
+        if not row:
+            rollback_db_connection()
+            if expected is not None:
+                return jsonify({"error": "Services were changed by someone else"}), 412
+            return jsonify({"error": "Service item not found"}), 404
+        notify_services_changed(conn)
+
+        node = row['node']
+        response = jsonify({"key": key, **{k: v for k, v in node.items() if k not in ('categories', 'items')}})
+        response.set_etag(services_etag(str(row['updated_at'])))
+        return response
+    except Exception as e:
+        print(f"Error patching service {key}: {e}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/api/services/migrate', methods=['POST'])
 def migrate_services():
@@ -166,70 +1785,391 @@ def migrate_services():
 # ROUTES - INVOICES
 # ============================================
 
+# Keys of a line item that have their own invoice_items column
+ITEM_FIELDS = ('id', 'name', 'quantity', 'unit', 'price', 'total', 'notes')
+
+# One invoice_items row as the JSON object clients expect
+ITEM_JSON_SQL = """jsonb_build_object(
+                   'id', ii.catalog_id, 'name', ii.name, 'quantity', ii.quantity,
+                   'unit', ii.unit, 'price', ii.price, 'total', ii.line_total,
+                   'notes', ii.notes) || COALESCE(ii.extra, '{}')"""
+
+# Line items rebuilt from invoice_items as the JSON array clients expect
+ITEMS_SQL = f"""COALESCE((
+        SELECT jsonb_agg({ITEM_JSON_SQL} ORDER BY ii.position)
+        FROM invoice_items ii WHERE ii.invoice_id = invoices.id
+    ), '[]'::jsonb)"""
+
+def invoice_select(columns=None):
+    """SELECT list for invoices with ``items`` hydrated from invoice_items"""
+    columns = columns or INVOICE_COLUMNS
+    return ', '.join(f"{ITEMS_SQL} AS items" if c == 'items' else f"invoices.{c}" for c in columns)
+
+def normalize_items(items, catalog=None):
+    """Typed invoice_items rows and the server-computed invoice total.
+
+    Line totals are quantity x price, rounded to cents; the client's totals
+    are ignored. Returns ``(rows, items_json, total)`` where ``items_json`` is
+    the same data for the legacy ``invoices.items`` column.
+    """
+    catalog = catalog or get_catalog()
+    rows, items_json, total = [], [], Decimal('0')
+    for position, item in enumerate(items):
+        # Rounded to the column scales so the stored row and JSON copy agree
+        quantity = Decimal(str(item.get('quantity') or 0)).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
+        price = Decimal(str(item.get('price') or 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        line_total = (quantity * price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        name = item.get('name') or item.get('service') or 'Unknown Item'
+        extra = {k: v for k, v in item.items() if k not in ITEM_FIELDS}
+        catalog_id = item.get('id')
+        rows.append((position, catalog_id, catalog.resolve(catalog_id) if catalog_id else None,
+                     name, quantity, item.get('unit'), price, line_total, item.get('notes'),
+                     Json(extra) if extra else None))
+        items_json.append({**item, 'name': name, 'quantity': float(quantity),
+                           'price': float(price), 'total': float(line_total)})
+        total += line_total
+    return rows, items_json, total
+
+INSERT_INVOICE_ITEMS = """
+    INSERT INTO invoice_items (invoice_id, position, catalog_id, service_key, name,
+                               quantity, unit, price, line_total, notes, extra)
+    VALUES %s
+"""
+
+def write_invoice_items(cursor, invoice_id, rows):
+    """Replace an invoice's line items in one batched statement"""
+    cursor.execute("DELETE FROM invoice_items WHERE invoice_id = %s", (invoice_id,))
+    if rows:
+        execute_values(cursor, INSERT_INVOICE_ITEMS, [(invoice_id,) + row for row in rows])
+
+INVOICE_COLUMNS = ('id', 'quote_number', 'client_name', 'client_number',
+                   'project_notes', 'items', 'total', 'created_at', 'updated_at')
+# Stored columns only (not search_vector), for RETURNING on writes
+INVOICE_RETURNING = ', '.join(INVOICE_COLUMNS)
+MAX_INVOICE_PAGE = 500
+
+def encode_invoice_cursor(row):
+    """Opaque keyset cursor for the (created_at, id) position of ``row``"""
+    created_at = row['created_at']
+    if hasattr(created_at, 'isoformat'):
+        created_at = created_at.isoformat()
+    raw = json.dumps([created_at, str(row['id'])])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_invoice_cursor(cursor_value):
+    created_at, invoice_id = json.loads(base64.urlsafe_b64decode(cursor_value.encode()))
+    return created_at, invoice_id
+
+def like_prefix(value):
+    """Escape LIKE wildcards so user input only ever matches as a prefix"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def parse_filter_time(value):
+    """ISO 8601 date or timestamp for the ``from``/``to`` filters; raises ValueError"""
+    if not isinstance(value, str):
+        raise ValueError(f"{value!r} is not a date")
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def invoice_filters(args):
+    """Build the WHERE clause for the invoice list filters in ``args``;
+    raises ValueError when ``from`` or ``to`` is not an ISO 8601 date"""
+    clauses, params = [], []
+    if args.get('client'):
+        clauses.append("lower(client_name) LIKE %s")
+        params.append(like_prefix(args['client'].lower()))
+    if args.get('quote_number'):
+        clauses.append("quote_number LIKE %s")
+        params.append(like_prefix(args['quote_number']))
+    if args.get('from'):
+        clauses.append("created_at >= %s")
+        params.append(parse_filter_time(args['from']))
+    if args.get('to'):
+        clauses.append("created_at < %s")
+        params.append(parse_filter_time(args['to']))
+    return clauses, params
+
 @app.route('/api/invoices', methods=['GET'])
 def get_invoices():
-    """Get all invoices from database"""
+    """Get invoices from database, newest first.
+
+    Query parameters (all optional):
+      limit         page size (max 500); without it every row is returned
+      cursor        value of X-Next-Cursor from the previous page
+      fields        comma-separated columns to return, e.g. id,client_name,total
+      client        client name prefix (case-insensitive)
+      quote_number  quote number prefix
+      from, to      created_at range, ``from`` inclusive and ``to`` exclusive
+      count         "true" to return the filtered total in X-Total-Count
+    """
     try:
-        conn = get_db_connection()
-        cursor = cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT * FROM invoices ORDER BY created_at DESC")
+        fields = request.args.get('fields')
+        if fields:
+            columns = [f for f in fields.split(',') if f]
+            unknown = set(columns) - set(INVOICE_COLUMNS)
+            if unknown:
+                return jsonify({"error": f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+            # id and created_at are always needed to build the next cursor
+            columns = ['id', 'created_at'] + [c for c in columns if c not in ('id', 'created_at')]
+        else:
+            columns = list(INVOICE_COLUMNS)
+
+        limit = request.args.get('limit', type=int)
+        if limit is not None and not 0 < limit <= MAX_INVOICE_PAGE:
+            return jsonify({"error": f"limit must be between 1 and {MAX_INVOICE_PAGE}"}), 400
+
+        try:
+            clauses, params = invoice_filters(request.args)
+        except ValueError:
+            return jsonify({"error": "from/to must be ISO 8601 dates"}), 400
+        count_clauses, count_params = list(clauses), list(params)
+
+        if request.args.get('cursor'):
+            try:
+                created_at, invoice_id = decode_invoice_cursor(request.args['cursor'])
+            except Exception:
+                return jsonify({"error": "Invalid cursor"}), 400
+            clauses.append("(invoices.created_at, invoices.id) < (%s, %s)")
+            params += [created_at, invoice_id]
+
+        query = f"SELECT {invoice_select(columns)} FROM invoices"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY created_at DESC, id DESC"
+        if limit is not None:
+            # Fetch one extra row to learn whether another page exists
+            query += " LIMIT %s"
+            params.append(limit + 1)
+
+        conn = get_read_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(query, params)
         invoices = cursor.fetchall()
+
+        total = None
+        if request.args.get('count') == 'true':
+            count_query = "SELECT count(*) AS total FROM invoices"
+            if count_clauses:
+                count_query += " WHERE " + " AND ".join(count_clauses)
+            cursor.execute(count_query, count_params)
+            total = cursor.fetchone()['total']
         cursor.close()
-        conn.close()
-        return jsonify([dict(inv) for inv in invoices])
+
+        headers = {}
+        if limit is not None and len(invoices) > limit:
+            invoices = invoices[:limit]
+            headers['X-Next-Cursor'] = encode_invoice_cursor(invoices[-1])
+        if total is not None:
+            headers['X-Total-Count'] = str(total)
+        return jsonify(invoices), 200, headers
     except Exception as e:
         print(f"Error fetching invoices: {e}")
         return jsonify({"error": str(e)}), 500
 
+SEARCH_COLUMNS = ('id', 'quote_number', 'client_name', 'client_number', 'total', 'created_at')
+MAX_SEARCH_PAGE = 100
+MAX_SEARCH_TERMS = 8
+# ts_headline marks matches with these. Its parser drops anything that looks
+# like an HTML tag, so the text is HTML-escaped before it gets there.
+HIGHLIGHT_START, HIGHLIGHT_STOP = '\x01', '\x02'
+HIGHLIGHT_OPTIONS = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords=16, MinWords=6'
+HIGHLIGHT_FIELDS = {
+    'quote_number': "quote_number",
+    'client_name': "client_name",
+    'client_number': "client_number",
+    'project_notes': "project_notes",
+    'items': """(SELECT string_agg(value, ' · ') FROM jsonb_array_elements_text(
+                    jsonb_path_query_array(COALESCE(items::jsonb, '[]'), '$[*].name')
+                    || jsonb_path_query_array(COALESCE(items::jsonb, '[]'), '$[*].notes ? (@ != "")')))""",
+}
+
+def sql_html_escape(expr):
+    return f"replace(replace(replace(COALESCE({expr}, ''), '&', '&amp;'), '<', '&lt;'), '>', '&gt;')"
+
+_trigram_available = None
+
+def trigram_available():
+    """Whether pg_trgm is installed (checked once per process)"""
+    global _trigram_available
+    if _trigram_available is None:
+        with get_read_connection().cursor() as cursor:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            _trigram_available = cursor.fetchone()[0]
+    return _trigram_available
+
+def search_tsquery(text):
+    """Prefix tsquery (``word:* & ...``) from free text, or None"""
+    terms = [t for t in re.findall(r'\w+', text.lower()) if t.strip('_')][:MAX_SEARCH_TERMS]
+    return ' & '.join(f"{term}:*" for term in terms) or None
+
+def render_highlight(text):
+    """Turn ts_headline's match markers into <mark>"""
+    return text.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+
+@app.route('/api/invoices/search', methods=['GET'])
+def search_invoices():
+    """Ranked search over invoices.
+
+    Query parameters:
+      q       search text (required). Words match as prefixes against the
+              quote number, client, project notes and line item names and
+              notes; with pg_trgm, misspelt client names, client numbers and
+              quote numbers match too.
+      limit   page size (default 20, max 100)
+      cursor  value of X-Next-Cursor from the previous page
+
+    Each result carries ``rank`` and ``highlights``: HTML snippets with the
+    matches in <mark>, for the fields that matched.
+    """
+    try:
+        text = (request.args.get('q') or '').strip()
+        if not text:
+            return jsonify({"error": "q is required"}), 400
+        limit = request.args.get('limit', 20, type=int)
+        if not 0 < limit <= MAX_SEARCH_PAGE:
+            return jsonify({"error": f"limit must be between 1 and {MAX_SEARCH_PAGE}"}), 400
+        offset = 0
+        if request.args.get('cursor'):
+            try:
+                offset = int(base64.urlsafe_b64decode(request.args['cursor'].encode()))
+            except Exception:
+                return jsonify({"error": "Invalid cursor"}), 400
+
+        params = {'tsq': search_tsquery(text), 'q': text, 'limit': limit + 1, 'offset': offset}
+        matches = ["invoices.search_vector @@ query.tsq"]
+        rank = "COALESCE(ts_rank_cd(invoices.search_vector, query.tsq, 32), 0)"
+        if trigram_available():
+            # Each arm can use its own GIN index; the planner ORs the bitmaps
+            matches += ["%(q)s <%% invoices.client_name", "%(q)s <%% invoices.client_number",
+                        "invoices.quote_number %% %(q)s"]
+            rank += """ + COALESCE(GREATEST(word_similarity(%(q)s, invoices.client_name),
+                                            word_similarity(%(q)s, invoices.client_number),
+                                            similarity(%(q)s, invoices.quote_number)), 0)"""
+        elif params['tsq'] is None:
+            return jsonify([]), 200
+
+        # Headlines are costly, so only the returned page gets them
+        headlines = ', '.join(
+            f"CASE WHEN query.tsq IS NOT NULL THEN ts_headline('simple', {sql_html_escape(expr)}, query.tsq, %(options)s) END AS hl_{name}"
+            for name, expr in HIGHLIGHT_FIELDS.items())
+        params['options'] = HIGHLIGHT_OPTIONS
+        columns = ', '.join(f"invoices.{c}" for c in SEARCH_COLUMNS)
+        query = f"""
+            WITH query AS (SELECT to_tsquery('simple', %(tsq)s) AS tsq),
+            page AS (
+                SELECT {columns}, invoices.project_notes, invoices.items, {rank} AS rank
+                FROM invoices, query
+                WHERE {' OR '.join(matches)}
+                ORDER BY rank DESC, invoices.created_at DESC, invoices.id DESC
+                LIMIT %(limit)s OFFSET %(offset)s
+            )
+            SELECT invoices.*, {headlines}
+            FROM page AS invoices, query
+            ORDER BY rank DESC, created_at DESC, id DESC
+        """
+
+        conn = get_read_connection()
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        results = []
+        for row in rows[:limit]:
+            result = {c: row[c] for c in SEARCH_COLUMNS}
+            result['rank'] = round(float(row['rank']), 4)
+            result['highlights'] = {
+                name: render_highlight(row[f'hl_{name}'])
+                for name in HIGHLIGHT_FIELDS if row[f'hl_{name}'] and HIGHLIGHT_START in row[f'hl_{name}']}
+            results.append(result)
+
+        headers = {}
+        if len(rows) > limit:
+            headers['X-Next-Cursor'] = base64.urlsafe_b64encode(str(offset + limit).encode()).decode()
+        return jsonify(results), 200, headers
+    except Exception as e:
+        print(f"Error searching invoices: {e}")
+        rollback_db_connection()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/invoices/<invoice_id>', methods=['GET'])
+def get_invoice(invoice_id):
+    """Get a single invoice from database"""
+    try:
+        conn = get_read_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"SELECT {invoice_select()} FROM invoices WHERE id = %s", (invoice_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        if row:
+            response = jsonify(row)
+            response.set_etag(invoice_etag(row))
+            return response
+        return jsonify({"error": "Invoice not found"}), 404
+    except Exception as e:
+        print(f"Error fetching invoice: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/invoices', methods=['POST'])
 def create_invoice():
-    """Create new invoice in database"""
+    """Create new invoice in database.
+
+    The client may supply the invoice ``id`` (a UUID). Re-sending a create
+    with an id that already exists returns that invoice with 200 instead of
+    a duplicate, so queued offline saves can safely be replayed.
+    """
     try:
         invoice = request.json
         
-        # Get settings for quote number
-        settings = get_setting('company_settings', {
-            'quote_prefix': 'JN',
-            'next_quote_number': 5401
-        })
-        
-        # Generate quote number
-        quote_number = f"{settings.get('quote_prefix', 'JN')}{settings.get('next_quote_number', 5401)}"
-        invoice_id = str(uuid.uuid4())
+        # Get settings for quote prefix
+        settings = get_setting('company_settings', {'quote_prefix': 'JN'})
+        quote_prefix = settings.get('quote_prefix', 'JN')
+        if invoice.get('id'):
+            try:
+                invoice_id = str(uuid.UUID(str(invoice['id'])))
+            except ValueError:
+                return jsonify({"error": "id must be a UUID"}), 400
+            conn = get_db_connection()
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"SELECT {invoice_select()} FROM invoices WHERE id = %s", (invoice_id,))
+                existing = cursor.fetchone()
+            if existing:
+                return jsonify(existing)
+        else:
+            invoice_id = str(uuid.uuid4())
         
         # Use Australian timezone
-        aus_tz = pytz.timezone('Australia/Sydney')
-        created_at = datetime.now(aus_tz).isoformat()
+        created_at = sydney_now().isoformat()
+        
+        item_rows, items_json, total = normalize_items(invoice['items'])
         
-        # Save to database
+        # Save to database, allocating the quote number in the same statement
         conn = get_db_connection()
-        cursor = cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("""
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"""
             INSERT INTO invoices (id, quote_number, client_name, client_number, 
                                  project_notes, items, total, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING *
+            VALUES (%s, %s || nextval('quote_number_seq'), %s, %s, %s, %s, %s, %s)
+            RETURNING {INVOICE_RETURNING}
         """, (
             invoice_id,
-            quote_number,
+            quote_prefix,
             invoice['clientName'],
             invoice.get('clientNumber', ''),
             invoice.get('projectNotes', ''),
-            Json(invoice['items']),
-            invoice['total'],
+            Json(items_json),
+            total,
             created_at
         ))
         
         result = cursor.fetchone()
+        write_invoice_items(cursor, invoice_id, item_rows)
         conn.commit()
         cursor.close()
-        conn.close()
+        settings_cache.invalidate(QUOTE_COUNTER_KEY)
         
-        # Increment quote number
-        settings['next_quote_number'] = settings.get('next_quote_number', 5401) + 1
-        set_setting('company_settings', settings)
-        
-        return jsonify(dict(result)), 201
+        response = jsonify(result)
+        response.status_code = 201
+        response.set_etag(invoice_etag(result))
+        return response
         
     except Exception as e:
         print(f"Error creating invoice: {e}")
@@ -240,55 +2180,486 @@ def delete_invoice(invoice_id):
     """Delete invoice from database"""
     try:
         conn = get_db_connection()
-        cursor = cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
         cursor.execute("DELETE FROM invoices WHERE id = %s", (invoice_id,))
         conn.commit()
         cursor.close()
-        conn.close()
         return jsonify({"message": "Invoice deleted successfully"})
     except Exception as e:
         print(f"Error deleting invoice: {e}")
         return jsonify({"error": str(e)}), 500
 
+def invoice_etag(row):
+    """Validator for an invoice: the time of its last write"""
+    stamp = row.get('updated_at') or row.get('created_at')
+    return base64.urlsafe_b64encode(str(stamp).encode()).decode() if stamp else None
+
+# Compares the stored write time with the one named by If-Match
+INVOICE_PRECONDITION = "COALESCE(updated_at, created_at) = %s"
+
+def invoice_write_conflict(cursor, invoice_id):
+    """404 or 412 for a conditional write that matched no row"""
+    cursor.execute("SELECT id, created_at, updated_at FROM invoices WHERE id = %s", (invoice_id,))
+    current = cursor.fetchone()
+    rollback_db_connection()
+    if current is None:
+        return jsonify({"error": "Invoice not found"}), 404
+    response = jsonify({"error": "Invoice was changed by someone else"})
+    response.status_code = 412
+    response.set_etag(invoice_etag(current))
+    return response
+
 @app.route('/api/invoices/<invoice_id>', methods=['PUT'])
 def update_invoice(invoice_id):
-    """Update invoice in database"""
+    """Update invoice in database; an If-Match header makes the write conditional"""
     try:
         invoice = request.json
         updated_at = datetime.now().isoformat()
+        expected = if_match_version()
+        if expected == '':
+            return jsonify({"error": "Invoice was changed by someone else"}), 412
+        
+        item_rows, items_json, total = normalize_items(invoice['items'])
         
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        cursor.execute("""
-            UPDATE invoices 
-            SET client_name = %s, client_number = %s, project_notes = %s,
-                items = %s, total = %s, updated_at = %s
-            WHERE id = %s
-            RETURNING *
-        """, (
+        params = [
             invoice['clientName'],
             invoice.get('clientNumber', ''),
             invoice.get('projectNotes', ''),
-            Json(invoice['items']),
-            invoice['total'],
+            Json(items_json),
+            total,
             updated_at,
             invoice_id
-        ))
+        ]
+        condition = ""
+        if expected is not None:
+            condition = f" AND {INVOICE_PRECONDITION}"
+            params.append(expected)
+        cursor.execute(f"""
+            UPDATE invoices 
+            SET client_name = %s, client_number = %s, project_notes = %s,
+                items = %s, total = %s, updated_at = %s
+            WHERE id = %s{condition}
+            RETURNING {INVOICE_RETURNING}
+        """, params)
         
         result = cursor.fetchone()
+        if not result and expected is not None:
+            return invoice_write_conflict(cursor, invoice_id)
+        if result:
+            write_invoice_items(cursor, result['id'], item_rows)
         conn.commit()
         cursor.close()
-        conn.close()
         
         if result:
-            return jsonify(dict(result))
+            response = jsonify(result)
+            response.set_etag(invoice_etag(result))
+            return response
         return jsonify({"error": "Invoice not found"}), 404
         
     except Exception as e:
         print(f"Error updating invoice: {e}")
         return jsonify({"error": str(e)}), 500
 
+# PATCH body keys for the plain invoice fields, and their columns
+INVOICE_PATCH_FIELDS = {'clientName': 'client_name', 'clientNumber': 'client_number',
+                        'projectNotes': 'project_notes'}
+
+def item_op_index(items, op, allow_end=False):
+    """Line addressed by an operation's ``index`` or (first matching) ``id``"""
+    if 'index' in op:
+        index = op['index']
+        last = len(items) if allow_end else len(items) - 1
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index <= last:
+            raise ValueError(f"index {index!r} is out of range")
+        return index
+    if allow_end:
+        return len(items)
+    if 'id' in op:
+        matches = [i for i, item in enumerate(items) if item.get('id') == op['id']]
+        if len(matches) != 1:
+            raise ValueError(f"id {op['id']!r} matches {len(matches)} lines")
+        return matches[0]
+    raise ValueError(f"{op.get('op')} needs an index or an id")
+
+def apply_item_ops(items, ops):
+    """Apply add/replace/remove operations, in order, to a copy of ``items``"""
+    if not isinstance(ops, list):
+        raise ValueError("items must be a list of operations")
+    items = [dict(item) for item in items]
+    for op in ops:
+        kind = op.get('op') if isinstance(op, dict) else None
+        if kind in ('add', 'replace') and not isinstance(op.get('item'), dict):
+            raise ValueError(f"{kind} needs an item object")
+        if kind == 'add':
+            items.insert(item_op_index(items, op, allow_end=True), dict(op['item']))
+        elif kind == 'replace':
+            # Merge, so a quantity change only has to send the quantity
+            items[item_op_index(items, op)].update(op['item'])
+        elif kind == 'remove':
+            del items[item_op_index(items, op)]
+        else:
+            raise ValueError(f"Unknown item operation {kind!r}")
+    return items
+
+def item_row_key(row):
+    """Comparable form of a normalize_items row"""
+    return row[:-1] + (row[-1].adapted if row[-1] is not None else None,)
+
+# Changed line items, as one jsonb parameter
+ITEM_RECORDSET = """jsonb_to_recordset(%s) AS v(
+    position integer, catalog_id text, service_key text, name text, quantity numeric,
+    unit text, price numeric, line_total numeric, notes text, extra jsonb)"""
+
+@app.route('/api/invoices/<invoice_id>', methods=['PATCH'])
+def patch_invoice(invoice_id):
+    """Apply a delta to an invoice, holding its row lock while items change.
+
+    Body: any of clientName, clientNumber and projectNotes, and ``items`` as
+    a list of operations applied in order:
+
+      {"op": "add", "item": {...}, "index": 2}        index optional (appends)
+      {"op": "replace", "index": 0, "item": {"quantity": 3}}
+      {"op": "remove", "id": "svc-tiling"}
+
+    ``replace`` merges the given fields into the line; lines are addressed
+    by ``index`` or by ``id`` when exactly one line has it. Line totals and
+    the invoice total are recomputed, and only changed invoice_items rows
+    are written. If-Match is required: send the ETag of the last read or
+    write; a stale one gets 412 with the current ETag.
+    """
+    patch = request.get_json(silent=True)
+    if not isinstance(patch, dict):
+        return jsonify({"error": "Body must be a JSON object"}), 400
+    unknown = set(patch) - set(INVOICE_PATCH_FIELDS) - {'items'}
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+    if not request.if_match:
+        return jsonify({"error": "If-Match is required"}), 428
+    expected = None if request.if_match.star_tag else if_match_version()
+    if expected == '':
+        return jsonify({"error": "Invoice was changed by someone else"}), 412
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+        sets = [f"{column} = %s" for key, column in INVOICE_PATCH_FIELDS.items() if key in patch]
+        params = [patch[key] or '' for key in INVOICE_PATCH_FIELDS if key in patch]
+        item_writes, item_params = "", []
+        if 'items' in patch:
+            # Lock the row first so the delta is computed from the lines it is
+            # written over; the items are read by a later statement because a
+            # statement that waited for the lock still sees its old snapshot
+            condition = f" AND {INVOICE_PRECONDITION}" if expected is not None else ""
+            cursor.execute(f"SELECT id FROM invoices WHERE id = %s{condition} FOR UPDATE",
+                           (invoice_id,) if expected is None else (invoice_id, expected))
+            if cursor.fetchone() is None:
+                return invoice_write_conflict(cursor, invoice_id)
+            cursor.execute(f"SELECT {invoice_select(('id', 'items'))} FROM invoices WHERE id = %s", (invoice_id,))
+            current = cursor.fetchone()
+            try:
+                items = apply_item_ops(current['items'], patch['items'])
+            except ValueError as e:
+                rollback_db_connection()
+                return jsonify({"error": str(e)}), 400
+
+            catalog = get_catalog()
+            old_rows = normalize_items(current['items'], catalog)[0]
+            new_rows, items_json, total = normalize_items(items, catalog)
+            changed = [row for row in new_rows
+                       if row[0] >= len(old_rows) or item_row_key(row) != item_row_key(old_rows[row[0]])]
+            sets += ["items = %s", "total = %s"]
+            params += [Json(items_json), total]
+            # Lines past the new end go; new or changed positions are upserted
+            item_writes = f"""
+            , trimmed AS (
+                DELETE FROM invoice_items
+                WHERE invoice_id IN (SELECT id FROM inv) AND position >= %s
+            ), upserted AS (
+                INSERT INTO invoice_items (invoice_id, position, catalog_id, service_key, name,
+                                           quantity, unit, price, line_total, notes, extra)
+                SELECT inv.id, v.* FROM inv, {ITEM_RECORDSET}
+                ON CONFLICT (invoice_id, position) DO UPDATE
+                SET catalog_id = excluded.catalog_id, service_key = excluded.service_key,
+                    name = excluded.name, quantity = excluded.quantity, unit = excluded.unit,
+                    price = excluded.price, line_total = excluded.line_total,
+                    notes = excluded.notes, extra = excluded.extra
+            )"""
+            item_params = [len(new_rows), Json([
+                {"position": row[0], "catalog_id": row[1], "service_key": row[2], "name": row[3],
+                 "quantity": str(row[4]), "unit": row[5], "price": str(row[6]),
+                 "line_total": str(row[7]), "notes": row[8],
+                 "extra": row[9].adapted if row[9] is not None else None}
+                for row in changed])]
+
+        sets.append("updated_at = %s")
+        params += [sydney_now().isoformat(), invoice_id]
+        condition = ""
+        if expected is not None:
+            condition = f" AND {INVOICE_PRECONDITION}"
+            params.append(expected)
+        params += item_params
+
+        cursor.execute(f"""
+            WITH inv AS (
+                UPDATE invoices SET {', '.join(sets)}
+                WHERE id = %s{condition}
+                RETURNING {INVOICE_RETURNING}
+            ){item_writes}
+            SELECT * FROM inv
+        """, params)
+        result = cursor.fetchone()
+        if not result:
+            return invoice_write_conflict(cursor, invoice_id)
+        conn.commit()
+        cursor.close()
+
+        response = jsonify(result)
+        response.set_etag(invoice_etag(result))
+        return response
+    except Exception as e:
+        print(f"Error patching invoice: {e}")
+        rollback_db_connection()
+        return jsonify({"error": str(e)}), 500
+
+# ============================================
+# BULK INVOICE EXPORT / IMPORT
+# ============================================
+
+BULK_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+BULK_COLUMNS = ('id', 'quote_number', 'client_name', 'client_number', 'project_notes',
+                'total', 'created_at', 'updated_at', 'items')
+BULK_EXPORT_CHUNK = 64 * 1024
+IMPORT_BATCH_SIZE = int(os.environ.get('INVOICE_IMPORT_BATCH', 500))
+MAX_IMPORT_ERRORS = 100
+
+def bulk_format(default='ndjson'):
+    """``format`` argument, or the format named by the request's Content-Type"""
+    fmt = request.args.get('format')
+    if not fmt and request.mimetype:
+        fmt = next((k for k, v in BULK_FORMATS.items() if v == request.mimetype), None)
+    return fmt or default
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+class CsvLineWriter:
+    """File-like target that hands csv.writer output back as strings"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def drain(self):
+        text = ''.join(self.parts)
+        self.parts = []
+        return text
+
+@app.route('/api/invoices/bulk', methods=['GET'])
+def export_invoice_data():
+    """Stream invoices as NDJSON (default) or CSV.
+
+    Takes the GET /api/invoices filters. Rows come from a server-side cursor
+    and are sent in ~64KB chunks, so memory stays flat whatever the size of
+    the export. In CSV the ``items`` column holds the items as JSON.
+    """
+    fmt = bulk_format()
+    if fmt not in BULK_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(BULK_FORMATS)}"}), 400
+    try:
+        clauses, params = invoice_filters(request.args)
+    except ValueError:
+        return jsonify({"error": "from/to must be ISO 8601 dates"}), 400
+    query = f"SELECT {invoice_select(BULK_COLUMNS)} FROM invoices"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY created_at, id"
+
+    def generate():
+        conn = get_read_connection()
+        cursor = conn.cursor(name=f"bulk_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+        cursor.itersize = 500
+        buffer, size = [], 0
+        out = CsvLineWriter()
+        writer = csv.writer(out)
+        try:
+            cursor.execute(query, params)
+            if fmt == 'csv':
+                writer.writerow(BULK_COLUMNS)
+                buffer.append(out.drain())
+            for row in cursor:
+                if fmt == 'csv':
+                    writer.writerow([json.dumps(row['items'], default=json_default) if c == 'items'
+                                     else json_default(row[c]) if row[c] is not None else ''
+                                     for c in BULK_COLUMNS])
+                    line = out.drain()
+                else:
+                    line = json.dumps(row, default=json_default) + '\n'
+                buffer.append(line)
+                size += len(line)
+                if size >= BULK_EXPORT_CHUNK:
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+            yield ''.join(buffer)
+        except Exception as e:
+            print(f"Error exporting invoices: {e}")
+            raise
+        finally:
+            cursor.close()
+
+    filename = f"invoices_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype=BULK_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+def read_import_rows(fmt, stream):
+    """Yield ``(line_number, row dict or error)`` from an NDJSON or CSV body"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, {k: v for k, v in row.items() if v not in (None, '')}
+        return
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            yield number, e
+
+def prepare_import_row(row, catalog, default_id=None):
+    """Invoice tuple fields for one imported row; raises ValueError when invalid.
+
+    Accepts the export's column names as well as the camelCase fields of
+    POST /api/invoices. Totals are recomputed from the items. A row without
+    an id gets ``default_id``, or a random one.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("expected a JSON object")
+    client_name = row.get('client_name', row.get('clientName'))
+    if not client_name:
+        raise ValueError("client_name is required")
+    items = row.get('items') or []
+    if isinstance(items, str):
+        items = json.loads(items)
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValueError("items must be a list of objects")
+    item_rows, items_json, total = normalize_items(items, catalog)
+    return {
+        "id": str(uuid.UUID(str(row['id']))) if row.get('id') else str(default_id or uuid.uuid4()),
+        "quote_number": str(row.get('quote_number', row.get('quoteNumber')) or '') or None,
+        "client_name": client_name,
+        "client_number": row.get('client_number', row.get('clientNumber', '')),
+        "project_notes": row.get('project_notes', row.get('projectNotes', '')),
+        "items": items_json,
+        "item_rows": item_rows,
+        "total": total,
+        "created_at": row.get('created_at', row.get('createdAt')),
+        "updated_at": row.get('updated_at', row.get('updatedAt')),
+    }
+
+def import_invoice_batch(conn, batch, quote_prefix, now):
+    """Insert one batch in its own transaction; returns the inserted count.
+
+    Rows without a quote number draw from quote_number_seq in one round
+    trip. Rows whose id already exists are left untouched, so re-running an
+    import is safe.
+    """
+    with conn.cursor() as cursor:
+        missing = [row for row in batch if not row['quote_number']]
+        if missing:
+            cursor.execute("SELECT nextval('quote_number_seq') FROM generate_series(1, %s)", (len(missing),))
+            for row, (number,) in zip(missing, cursor.fetchall()):
+                row['quote_number'] = f"{quote_prefix}{number}"
+        inserted = execute_values(cursor, """
+            INSERT INTO invoices (id, quote_number, client_name, client_number, project_notes,
+                                  items, total, created_at, updated_at)
+            VALUES %s
+            ON CONFLICT (id) DO NOTHING
+            RETURNING id
+        """, [(row['id'], row['quote_number'], row['client_name'], row['client_number'],
+               row['project_notes'], Json(row['items']), row['total'],
+               row['created_at'] or now, row['updated_at']) for row in batch],
+            page_size=len(batch), fetch=True)
+        inserted_ids = {str(invoice_id) for (invoice_id,) in inserted}
+        item_values = [(row['id'],) + item for row in batch if row['id'] in inserted_ids
+                       for item in row['item_rows']]
+        if item_values:
+            execute_values(cursor, INSERT_INVOICE_ITEMS, item_values, page_size=1000)
+    conn.commit()
+    return len(inserted_ids)
+
+@app.route('/api/invoices/bulk', methods=['POST'])
+def import_invoice_data():
+    """Bulk-load invoices from an NDJSON or CSV body.
+
+    The body is read as a stream and written in batches of
+    INVOICE_IMPORT_BATCH rows per transaction on a single connection.
+    Invalid rows are reported by line number and skipped. Imported quote
+    numbers with the current prefix move the sequence past them.
+    """
+    fmt = bulk_format()
+    if fmt not in BULK_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(BULK_FORMATS)}"}), 400
+
+    settings = get_setting('company_settings', {'quote_prefix': 'JN'})
+    quote_prefix = settings.get('quote_prefix', 'JN')
+    catalog = get_catalog()
+    now = sydney_now().isoformat()
+    conn = get_db_connection()
+    imported = duplicates = invalid = 0
+    errors = []
+    highest = 0
+    batch = []
+
+    def flush():
+        nonlocal imported, duplicates, highest
+        count = import_invoice_batch(conn, batch, quote_prefix, now)
+        imported += count
+        duplicates += len(batch) - count
+        for row in batch:
+            suffix = row['quote_number'][len(quote_prefix):]
+            if row['quote_number'].startswith(quote_prefix) and suffix.isdigit():
+                highest = max(highest, int(suffix))
+        batch.clear()
+
+    try:
+        for line, row in read_import_rows(fmt, request.stream):
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                batch.append(prepare_import_row(row, catalog))
+            except (ValueError, TypeError, ArithmeticError) as e:
+                invalid += 1
+                if len(errors) < MAX_IMPORT_ERRORS:
+                    errors.append({"line": line, "error": str(e)})
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+
+        raise_next_quote_number(highest + 1)
+        conn.commit()
+    except Exception as e:
+        print(f"Error importing invoices: {e}")
+        rollback_db_connection()
+        return jsonify({"error": str(e), "imported": imported, "errors": errors}), 500
+
+    return jsonify({"imported": imported, "duplicates": duplicates, "invalid": invalid, "errors": errors})
+
 # ============================================
 # ROUTES - JOB SUMMARY
 # ============================================
@@ -328,233 +2699,909 @@ def get_company_settings():
         "bank_bsb": "",
         "bank_account": ""
     }
-    settings = get_setting('company_settings', defaults)
-    return jsonify(settings)
+    stored, version = get_setting_with_version('company_settings', defaults)
+    settings = dict(stored)
+    try:
+        settings['next_quote_number'] = get_next_quote_number()
+    except Exception as e:
+        print(f"Error reading quote number sequence: {e}")
+        rollback_db_connection()
+
+    # The validator covers the overlaid quote number as well as the row
+    etag = hashlib.sha256(f"{version}:{settings.get('next_quote_number')}".encode()).hexdigest()[:32]
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    response = jsonify(settings)
+    response.set_etag(etag)
+    return response
 
 @app.route('/api/company-settings', methods=['PUT'])
 def update_company_settings():
     """Update company settings in database"""
     settings = request.json
+
+    # Move the quote sequence only when the prefix changes or the number is
+    # raised, so a stale settings form can never reissue existing numbers
+    next_number = settings.get('next_quote_number')
+    if next_number:
+        try:
+            current = get_setting('company_settings', {})
+            if settings.get('quote_prefix') != current.get('quote_prefix'):
+                set_next_quote_number(int(next_number))
+            else:
+                raise_next_quote_number(int(next_number))
+        except Exception as e:
+            print(f"Error updating quote number sequence: {e}")
+            rollback_db_connection()
+            return jsonify({"error": "Failed to update settings"}), 500
+
     success = set_setting('company_settings', settings)
     if success:
         return jsonify({"message": "Company settings updated successfully"})
     return jsonify({"error": "Failed to update settings"}), 500
 
+# ============================================
+# ROUTES - REPORTS
+# ============================================
+
+# Reports read the report_* rollups, which triggers keep in step with every
+# write to invoices and invoice_items (see SCHEMA_STATEMENTS)
+
+def report_month_filter(args):
+    """WHERE clause and params for ``from``/``to`` months (YYYY-MM, inclusive)"""
+    clauses, params = ["invoice_count > 0"], []
+    for arg, op in (('from', '>='), ('to', '<=')):
+        if args.get(arg):
+            month = datetime.strptime(args[arg][:7], '%Y-%m').date()
+            clauses.append(f"month {op} %s")
+            params.append(month)
+    return " WHERE " + " AND ".join(clauses), params
+
+def report_limit(args, default=10):
+    return max(1, min(int(args.get('limit', default)), 500))
+
+def run_report(query, params=()):
+    conn = get_read_connection()
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    conn.commit()
+    return [{k: float(v) if isinstance(v, Decimal) else v for k, v in row.items()} for row in rows]
+
+@app.route('/api/reports/revenue-by-month', methods=['GET'])
+def report_revenue_by_month():
+    """Invoice count, revenue (ex GST) and GST per month, Sydney time"""
+    try:
+        where, params = report_month_filter(request.args)
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM"}), 400
+    try:
+        rows = run_report(f"""
+            SELECT to_char(month, 'YYYY-MM') AS month, invoice_count, revenue, gst,
+                   revenue + gst AS total_inc_gst
+            FROM report_monthly_live{where}
+            ORDER BY month
+        """, params)
+        return jsonify(rows)
+    except Exception as e:
+        print(f"Error loading monthly report: {e}")
+        rollback_db_connection()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/reports/revenue-by-service', methods=['GET'])
+def report_revenue_by_service():
+    """Revenue per catalog entry and per category.
+
+    Lines that were not picked from the catalog are grouped under the
+    empty key.
+    """
+    try:
+        rows = run_report("""
+            SELECT service_key, line_count, quantity, revenue FROM report_services_live
+            WHERE line_count > 0 ORDER BY revenue DESC
+        """)
+        catalog = get_catalog()
+        categories = {}
+        for row in rows:
+            key = row['service_key']
+            node = catalog.by_key.get(key, (None, {}))[1]
+            row['name'] = node.get('name', key) if key else 'Custom items'
+            row['category'] = key.rsplit('.', 1)[0] if '.' in key else key
+            category = categories.setdefault(row['category'], {
+                "category": row['category'],
+                "name": catalog.by_key.get(row['category'], (None, {}))[1].get('name', row['category'] or 'Custom items'),
+                "line_count": 0, "revenue": 0.0})
+            category['line_count'] += row['line_count']
+            category['revenue'] = round(category['revenue'] + row['revenue'], 2)
+        return jsonify({
+            "services": rows,
+            "categories": sorted(categories.values(), key=lambda c: -c['revenue'])
+        })
+    except Exception as e:
+        print(f"Error loading service report: {e}")
+        rollback_db_connection()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/reports/top-clients', methods=['GET'])
+def report_top_clients():
+    """Clients by revenue (ex GST); ``limit`` defaults to 10"""
+    try:
+        limit = report_limit(request.args)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    try:
+        rows = run_report("""
+            SELECT client_name, invoice_count, revenue FROM report_clients_live
+            WHERE invoice_count > 0 ORDER BY revenue DESC, client_name LIMIT %s
+        """, (limit,))
+        return jsonify(rows)
+    except Exception as e:
+        print(f"Error loading client report: {e}")
+        rollback_db_connection()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/reports/gst', methods=['GET'])
+def report_gst():
+    """GST collected per calendar quarter (BAS periods) plus totals"""
+    try:
+        where, params = report_month_filter(request.args)
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM"}), 400
+    try:
+        quarters = run_report(f"""
+            SELECT to_char(date_trunc('quarter', month), 'YYYY-"Q"Q') AS quarter,
+                   sum(invoice_count)::bigint AS invoice_count, sum(revenue) AS revenue, sum(gst) AS gst,
+                   sum(revenue + gst) AS total_inc_gst
+            FROM report_monthly_live{where}
+            GROUP BY 1 ORDER BY 1
+        """, params)
+        totals = {k: round(sum(q[k] for q in quarters), 2)
+                  for k in ('invoice_count', 'revenue', 'gst', 'total_inc_gst')}
+        return jsonify({"quarters": quarters, "totals": totals})
+    except Exception as e:
+        print(f"Error loading GST report: {e}")
+        rollback_db_connection()
+        return jsonify({"error": str(e)}), 500
+
+# ============================================
+# PDF CACHE
+# ============================================
+
+# Bump whenever generate_pdf output changes so cached renders are not reused
+PDF_LAYOUT_VERSION = 3
+
+# Logo resolution (DPI at its drawn size) and JPEG quality for each
+# PDF_QUALITY setting; "original" embeds the uploaded file untouched
+PDF_QUALITY_PRESETS = {
+    'screen': (96, 70),
+    'standard': (150, 80),
+    'print': (300, 90),
+    'original': (None, None),
+}
+PDF_QUALITY = os.environ.get('PDF_QUALITY', 'standard')
+if PDF_QUALITY not in PDF_QUALITY_PRESETS:
+    raise ValueError(f"PDF_QUALITY must be one of {', '.join(PDF_QUALITY_PRESETS)}")
+
+class PdfCache:
+    """Rendered PDF bytes keyed by content, in a byte-bounded LRU.
+
+    With ``directory`` set, renders are also written there so every worker
+    (and restarts) can reuse them; files are written atomically. Bytes
+    written are added to a running total, seeded from the directory once;
+    when it passes ``dir_max_bytes`` the directory is rescanned and the least
+    recently used files are pruned to 90% of the limit.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, dir_max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.dir_max_bytes = dir_max_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._dir_size = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._dir_size = sum(size for _, size, _ in self._scan())
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        if self.directory:
+            try:
+                os.utime(self._path(key))
+                with open(self._path(key), 'rb') as f:
+                    data = f.read()
+                self.disk_hits += 1
+                self._remember(key, data)
+                return data
+            except OSError:
+                # Missing, pruned mid-read or unreadable: render again
+                pass
+        self.misses += 1
+        return None
+
+    def put(self, key, data):
+        self._remember(key, data)
+        self._write(key, lambda f: f.write(data))
+
+    def put_file(self, key, source):
+        """Cache a render held in a file; it goes to the disk tier only,
+        since only the largest quotes are rendered to files"""
+        source.seek(0)
+        self._write(key, lambda f: shutil.copyfileobj(source, f))
+
+    def _write(self, key, write):
+        if not self.directory:
+            return
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+                size = f.tell()
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Error writing PDF cache file: {e}")
+            return
+        with self._lock:
+            self._dir_size += size
+            if self._dir_size <= self.dir_max_bytes:
+                return
+        self._prune()
+
+    def _scan(self):
+        """``(mtime, size, path)`` of each cached file; other workers may be
+        pruning too, so vanished files are skipped"""
+        files = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith('.pdf'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            print(f"Error scanning PDF cache directory: {e}")
+        return files
+
+    def _prune(self):
+        """Delete the least recently used files (by mtime, which reads
+        refresh) until the directory is back under 90% of ``dir_max_bytes``,
+        so the next scan is some writes away"""
+        files = sorted(self._scan())
+        total = sum(size for _, size, _ in files)
+        target = self.dir_max_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error pruning PDF cache file: {e}")
+                continue
+            total -= size
+        with self._lock:
+            self._dir_size = total
+
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self._size,
+        }
+
+
+pdf_cache = PdfCache(
+    max_bytes=int(os.environ.get('PDF_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    directory=os.environ.get('PDF_CACHE_DIR') or None,
+    dir_max_bytes=int(os.environ.get('PDF_CACHE_DIR_MAX_BYTES', 1024 * 1024 * 1024)),
+)
+
+def as_datetime(value):
+    """Timestamps may come back as datetimes or ISO strings"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value
+
+def pdf_cache_key(invoice, settings, job_summary_text, quality=None):
+    """Content key (also used as the ETag) for one rendered quote"""
+    # Hash the settings content rather than trusting the cache's version, so
+    # keys agree across workers, pool processes and cache refreshes
+    settings_version = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+    parts = [
+        str(PDF_LAYOUT_VERSION),
+        quality or PDF_QUALITY,
+        str(invoice['id']),
+        str(invoice.get('updated_at') or invoice.get('created_at')),
+        settings_version,
+        hashlib.sha256(job_summary_text.encode()).hexdigest(),
+    ]
+    return hashlib.sha256('\x00'.join(parts).encode()).hexdigest()
+
+# Quotes with more line items than this render in streaming mode: items are
+# read through a server-side cursor as pages are laid out, and the route
+# spools the PDF to a temporary file instead of building it in memory
+PDF_STREAM_MIN_ITEMS = int(os.environ.get('PDF_STREAM_MIN_ITEMS', 500))
+# Streamed PDFs up to this size stay in memory; larger ones go to disk
+PDF_SPOOL_MAX_BYTES = int(os.environ.get('PDF_SPOOL_MAX_BYTES', 1024 * 1024))
+PDF_STREAM_FETCH = 1000
+
+def fetch_pdf_invoice(conn, invoice_id):
+    """The invoice to render, or None; ``items`` is a generator for large quotes"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f"""
+        SELECT {invoice_select([c for c in INVOICE_COLUMNS if c != 'items'])}, n.item_count,
+               CASE WHEN n.item_count <= %s THEN {ITEMS_SQL} END AS items
+        FROM invoices, LATERAL (
+            SELECT count(*) AS item_count FROM invoice_items ii WHERE ii.invoice_id = invoices.id
+        ) n
+        WHERE invoices.id = %s
+    """, (PDF_STREAM_MIN_ITEMS, invoice_id))
+    row = cursor.fetchone()
+    cursor.close()
+    if not row:
+        return None
+    invoice = dict(row)
+    item_count = invoice.pop('item_count')
+    if invoice['items'] is None:
+        invoice['items'] = stream_invoice_items(conn, invoice, item_count)
+    return invoice
+
+def stream_invoice_items(conn, invoice, count):
+    """Yield a large invoice's line items from a server-side cursor.
+
+    The cursor only matches while the invoice is at the version already
+    read (one statement sees one snapshot), so an edit in between fails the
+    render rather than caching new lines under the old ETag.
+    """
+    cursor = conn.cursor(name=f"items_{uuid.uuid4().hex}")
+    cursor.itersize = PDF_STREAM_FETCH
+    seen = 0
+    try:
+        cursor.execute(f"""
+            SELECT {ITEM_JSON_SQL}
+            FROM invoice_items ii JOIN invoices ON invoices.id = ii.invoice_id
+            WHERE ii.invoice_id = %s AND {INVOICE_PRECONDITION}
+            ORDER BY ii.position
+        """, (invoice['id'], invoice.get('updated_at') or invoice.get('created_at')))
+        for (item,) in cursor:
+            seen += 1
+            yield item
+    finally:
+        cursor.close()
+    if seen != count:
+        raise Exception("Invoice changed while its PDF was rendering, try again")
+
 # ============================================
 # ROUTES - PDF GENERATION
 # ============================================
 
 @app.route('/api/invoices/<invoice_id>/pdf', methods=['GET'])
 def generate_pdf_route(invoice_id):
-    """Generate PDF for invoice"""
+    """Generate PDF for invoice, or answer 304 if the client's copy is current.
+
+    ``?quality=`` picks a PDF_QUALITY_PRESETS entry (default: PDF_QUALITY).
+    Quotes over PDF_STREAM_MIN_ITEMS line items render in streaming mode.
+    """
+    quality = request.args.get('quality') or PDF_QUALITY
+    if quality not in PDF_QUALITY_PRESETS:
+        return jsonify({"error": f"quality must be one of {', '.join(PDF_QUALITY_PRESETS)}"}), 400
     try:
-        conn = get_db_connection()
-        cursor = cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT * FROM invoices WHERE id = %s", (invoice_id,))
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if not row:
+        invoice = fetch_pdf_invoice(get_read_connection(), invoice_id)
+        if invoice is None:
             return jsonify({"error": "Invoice not found"}), 404
         
-        invoice = dict(row)
-        
         # Get settings and job summary
         settings = get_setting('company_settings', {})
         summary_data = get_setting('job_summary', {"text": ""})
         job_summary_text = summary_data.get('text', '')
+
+        etag = pdf_cache_key(invoice, settings, job_summary_text, quality)
+        try:
+            last_modified = as_datetime(invoice.get('updated_at') or invoice.get('created_at'))
+        except ValueError:
+            last_modified = None
+
+        # The ETag covers settings and summary too, so it alone decides 304s
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        pdf_bytes = pdf_cache.get(etag)
+        if pdf_bytes is not None:
+            body, size = io.BytesIO(pdf_bytes), len(pdf_bytes)
+        elif isinstance(invoice['items'], list):
+            # Generate PDF
+            buffer = generate_pdf(invoice, settings, job_summary_text, quality=quality)
+            pdf_bytes = buffer.getvalue()
+            pdf_cache.put(etag, pdf_bytes)
+            body, size = io.BytesIO(pdf_bytes), len(pdf_bytes)
+        else:
+            # send_file streams the spooled file out in blocks
+            body = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES)
+            generate_pdf(invoice, settings, job_summary_text, quality=quality, out=body)
+            size = body.tell()
+            pdf_cache.put_file(etag, body)
+            body.seek(0)
         
-        # Generate PDF
-        buffer = generate_pdf(invoice, settings, job_summary_text)
-        buffer.seek(0)
-        
-        filename = f"quote_{invoice.get('quote_number', 'draft')}_{invoice.get('client_name', 'client').replace(' ', '_')}.pdf"
+        filename = pdf_filename(invoice)
         
-        return send_file(
-            buffer,
+        response = send_file(
+            body,
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=filename
+            download_name=filename,
+            etag=etag,
+            last_modified=last_modified,
+            conditional=False
         )
+        response.content_length = size
+        # Quotes are private; let browsers keep them but always revalidate
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
         print(f"Error generating PDF: {e}")
         return jsonify({"error": str(e)}), 500
 
+def pdf_filename(invoice):
+    return f"quote_{invoice.get('quote_number', 'draft')}_{invoice.get('client_name', 'client').replace(' ', '_')}.pdf"
+
 # ============================================
-# PDF GENERATION FUNCTION
+# BULK PDF EXPORT
 # ============================================
 
-def generate_pdf(invoice, settings, job_summary_text):
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4,
-                            topMargin=15*mm, bottomMargin=15*mm,
-                            leftMargin=15*mm, rightMargin=15*mm)
-
-    styles = getSampleStyleSheet()
-    
-    # --- HEADER STYLES ---
-    header_title = ParagraphStyle('HeaderTitle', parent=styles['Heading1'], fontSize=24, spaceAfter=8, textColor=colors.black)
-    header_text = ParagraphStyle('HeaderText', parent=styles['Normal'], fontSize=10, leading=14)
-    total_label_style = ParagraphStyle('TotalLabel', parent=styles['Normal'], alignment=TA_RIGHT)
-    
-    # --- JOB SUMMARY STYLES (NEW) ---
-    # Style for "JOB SUMMARY:" and "# Title"
-    summary_main = ParagraphStyle('SummaryMain', parent=styles['Normal'], fontSize=11, leading=15, fontName='Helvetica-Bold', spaceBefore=10, spaceAfter=4)
-    
-    # Style for "## Subtitle" (Just bold, same size as text)
-    summary_sub = ParagraphStyle('SummarySub', parent=styles['Normal'], fontSize=10, leading=14, fontName='Helvetica-Bold', spaceBefore=3)
-    
-    # Style for "* Bullet"
-    summary_bullet = ParagraphStyle('SummaryBullet', parent=styles['Normal'], fontSize=10, leading=14, leftIndent=12)
-
-    elements = []
-
-    # ================= HEADER SECTION =================
-    quote_num = invoice.get('quote_number', 'N/A')
-    try:
-        date_obj = datetime.fromisoformat(invoice['created_at'].replace('Z', '+00:00'))
-        date_str = date_obj.strftime('%d %B %Y')
-    except:
-        date_str = datetime.now().strftime('%d %B %Y')
-
-    left_column = [
-        Paragraph("<b>QUOTE</b>", header_title),
-        Paragraph(f"<b>Quote No:</b> {quote_num}", header_text),
-        Paragraph(f"<b>Quote Date:</b> {date_str}", header_text),
-        Paragraph(f"<b>ABN:</b> {settings.get('abn', '')}", header_text),
-        Spacer(1, 5*mm),
-        Paragraph("<b>QUOTE TO:</b>", header_text),
-        Paragraph(f"<b>Client Name:</b> {invoice.get('client_name', '')}", header_text),
-        Paragraph(f"<b>Client Number:</b> {invoice.get('client_number', '')}", header_text),
-    ]
+_export_pool = None
+_export_pool_pid = None
+
+def get_export_pool():
+    """Process pool for bulk renders; ReportLab is CPU-bound and holds the GIL.
+
+    Workers come from a forkserver rather than a fork of this process: its
+    background threads (settings listener, replica checker, requests) may
+    hold a lock at fork time, and a forked child would wait on it forever.
+    """
+    global _export_pool, _export_pool_pid
+    if _export_pool is None or _export_pool_pid != os.getpid():
+        _export_pool = ProcessPoolExecutor(max_workers=int(os.environ.get('PDF_EXPORT_WORKERS', os.cpu_count() or 2)),
+                                           mp_context=multiprocessing.get_context('forkserver'))
+        _export_pool_pid = os.getpid()
+    return _export_pool
+
+def reset_export_pool():
+    global _export_pool
+    if _export_pool is not None:
+        _export_pool.shutdown(wait=False, cancel_futures=True)
+    _export_pool = None
 
-    right_column = []
-    logo_path = os.path.join(app.root_path, 'static', 'logo.jpg')
-    if os.path.exists(logo_path):
-        logo = Image(logo_path, width=70*mm, height=40*mm)
-        logo.hAlign = 'RIGHT'
-        right_column.append(logo)
+def render_pdf_bytes(invoice, settings, job_summary_text):
+    """Process-pool entry point; calls pdf_render directly, since metrics
+    recorded in a pool worker would never reach /metrics anyway"""
+    import pdf_render
+    buffer, _, _ = pdf_render.generate_pdf(invoice, settings, job_summary_text, get_quote_template())
+    return buffer.getvalue()
+
+class ZipStream:
+    """Write-only file object that hands zipfile output to a generator"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def render_pdfs(invoices, settings, job_summary_text):
+    """Yield ``(invoice, pdf_bytes)`` as renders finish.
+
+    Cached renders are yielded straight away; the rest go to the process pool
+    with at most two renders per worker in flight, so memory stays bounded no
+    matter how many invoices are exported.
+    """
+    pool = get_export_pool()
+    window = pool._max_workers * 2
+    pending = {}
+
+    def finished(block):
+        done, _ = wait(pending, return_when=FIRST_COMPLETED) if block else (
+            [f for f in pending if f.done()], None)
+        for future in done:
+            invoice, key = pending.pop(future)
+            pdf_bytes = future.result()
+            pdf_cache.put(key, pdf_bytes)
+            yield invoice, pdf_bytes
+
+    try:
+        for invoice in invoices:
+            key = pdf_cache_key(invoice, settings, job_summary_text)
+            pdf_bytes = pdf_cache.get(key)
+            if pdf_bytes is not None:
+                yield invoice, pdf_bytes
+                continue
+            while len(pending) >= window:
+                yield from finished(block=True)
+            future = pool.submit(render_pdf_bytes, invoice, settings, job_summary_text)
+            pending[future] = (invoice, key)
+            yield from finished(block=False)
+        while pending:
+            yield from finished(block=True)
+    except BrokenProcessPool:
+        reset_export_pool()
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+MAX_EXPORT_IDS = 1000
+
+@app.route('/api/invoices/export', methods=['POST'])
+def export_invoices():
+    """Stream a ZIP of quote PDFs.
+
+    Body: ``{"ids": [...]}`` (at most MAX_EXPORT_IDS invoice UUIDs) or a
+    created_at range ``{"from": ..., "to": ...}``. Invoices are read with one
+    server-side cursor, opened before the response starts so a bad query
+    still gets an error status, and rendered in parallel by a process pool
+    (PDF_EXPORT_WORKERS); ZIP entries are sent as they finish.
+    """
+    body = request.json or {}
+    ids = body.get('ids')
+    if ids is not None:
+        try:
+            if not isinstance(ids, list) or not 0 < len(ids) <= MAX_EXPORT_IDS:
+                raise ValueError
+            ids = tuple(str(uuid.UUID(i)) for i in ids)
+        except (ValueError, TypeError, AttributeError):
+            return jsonify({"error": f"ids must be a list of 1 to {MAX_EXPORT_IDS} invoice ids"}), 400
+        query, params = f"SELECT {invoice_select()} FROM invoices WHERE id IN %s ORDER BY created_at", [ids]
     else:
-        right_column.append(Paragraph("<b>LOGO</b>", header_title))
-
-    header_data = [[left_column, right_column]]
-    header_table = Table(header_data, colWidths=[100*mm, 80*mm])
-    header_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('ALIGN', (0,0), (0,0), 'LEFT'),
-        ('ALIGN', (1,0), (1,0), 'RIGHT'),
-        ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('RIGHTPADDING', (0,0), (-1,-1), 0),
-    ]))
-    elements.append(header_table)
-    elements.append(Spacer(1, 5*mm))
-
-    # ================= JOB SUMMARY (Logic Updated) =================
-    if job_summary_text:
-        # Main Title
-        elements.append(Paragraph("JOB SUMMARY:", summary_main))
-
-        for line in job_summary_text.split('\n'):
-            line = line.strip()
-            if not line:
-                continue 
-
-            # CHECK 1: Starts with ## (Just Bold)
-            if line.startswith('##'):
-                clean_text = line[2:].strip() # Remove first 2 chars
-                elements.append(Paragraph(clean_text, summary_sub))
-            
-            # CHECK 2: Starts with # (Main Header Style)
-            elif line.startswith('#'):
-                clean_text = line[1:].strip() # Remove first 1 char
-                elements.append(Paragraph(clean_text, summary_main))
-                
-            # CHECK 3: Bullets
-            elif line.startswith('*') or line.startswith('-'):
-                clean_text = line.lstrip('*-').strip()
-                elements.append(Paragraph(f"• {clean_text}", summary_bullet))
-                
-            # CHECK 4: Normal Text
-            else:
-                elements.append(Paragraph(line, header_text))
-        
-        elements.append(Spacer(1, 5*mm))
+        try:
+            clauses, params = invoice_filters(body)
+        except ValueError:
+            return jsonify({"error": "from/to must be ISO 8601 dates"}), 400
+        if not clauses:
+            return jsonify({"error": "Provide ids or a from/to date range"}), 400
+        query = f"SELECT {invoice_select()} FROM invoices WHERE " + " AND ".join(clauses) + " ORDER BY created_at"
 
-    # ================= ITEMS TABLE =================
-    table_data = [['NO.', 'DESCRIPTION', 'QTY']]
-    
-    items = invoice.get('items', [])
-    if isinstance(items, str):
-        items = json.loads(items)
+    settings = get_setting('company_settings', {})
+    job_summary_text = get_setting('job_summary', {"text": ""}).get('text', '')
 
-    for idx, item in enumerate(items, start=1):
-        name = item.get('service', item.get('name', 'Unknown Item'))
-        if item.get('subService'):
-            name += f" - {item['subService']}"
-        
-        qty = float(item.get('quantity', 0))
-        
-        table_data.append([
-            str(idx),
-            Paragraph(name, header_text),
-            f"{qty} {item.get('unit','')}"
-        ])
-        
-        if item.get('notes'):
-            note_style = ParagraphStyle('note', parent=styles['Normal'], fontSize=9, textColor=colors.grey, fontName='Helvetica-Oblique')
-            table_data.append(['', Paragraph(f"<i>Note: {item['notes']}</i>", note_style), '' ])
-
-    # ================= TOTALS =================
-    subtotal = float(invoice.get('total', 0))
-    gst = subtotal * 0.1
-    grand_total = subtotal + gst
-
-    table_data.append(['', Paragraph('<b>Subtotal:</b>', total_label_style), f"${subtotal:.2f}"])
-    table_data.append(['', Paragraph('<b>GST (10%):</b>', total_label_style), f"${gst:.2f}"])
-    table_data.append(['', Paragraph('<b>Total:</b>', total_label_style), f"${grand_total:.2f}"])
-
-    table = Table(table_data, colWidths=[15*mm, 135*mm, 30*mm])
-    table.setStyle(TableStyle([
-        ('GRID',(0,0),(-1,-4),0.5,colors.grey),
-        ('FONTNAME',(0,0),(-1,0),'Helvetica-Bold'),
-        ('BACKGROUND',(0,0),(-1,0),colors.grey),
-        ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
-        ('ALIGN',(0,0),(0,-1),'CENTER'),
-        ('ALIGN',(2,0),(-1,-1),'CENTER'),
-        ('ALIGN',(2,-3),(-1,-1),'RIGHT'),
-        ('VALIGN',(0,0),(-1,-1),'TOP'),
-        ('LINEBELOW', (0,-4), (-1,-4), 1, colors.black),
-    ]))
-    elements.append(table)
-    elements.append(Spacer(1, 10*mm))
-
-    # ================= PAYMENT & FOOTER =================
-    elements.append(Paragraph("<b>PAYMENT OPTIONS</b>", styles['Heading2']))
-    elements.append(Spacer(1, 2*mm))
-    
-    payment_html = f"""
-    <b>Account Name:</b> {settings.get('bank_account_name', '')}<br/>
-    <b>BSB:</b> {settings.get('bank_bsb', '')}<br/>
-    <b>Account Number:</b> {settings.get('bank_account', '')}<br/>
-    <b>Reference:</b> {quote_num}
-    """
-    elements.append(Paragraph(payment_html, header_text))
-
-    elements.append(Spacer(1, 20*mm))
-    contact_info = f"""
-    <b>CONTACT:</b><br/>
-    {settings.get('company_name', '')}<br/>
-    {settings.get('phone', '')}<br/>
-    {settings.get('email', '')}<br/>
-    {settings.get('address', '')}<br/>
-    <b>{settings.get('area_manager', '')}</b>
-    """
-    elements.append(Paragraph(contact_info, header_text))
-
-    doc.build(elements)
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+        cursor.itersize = 50
+        cursor.execute(query, params)
+    except Exception as e:
+        print(f"Error exporting PDFs: {e}")
+        rollback_db_connection()
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        stream = ZipStream()
+        try:
+            names = set()
+            with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) as archive:
+                for invoice, pdf_bytes in render_pdfs((dict(row) for row in cursor), settings, job_summary_text):
+                    name = pdf_filename(invoice)
+                    if name in names:
+                        name = f"{name[:-4]}_{invoice['id']}.pdf"
+                    names.add(name)
+                    archive.writestr(name, pdf_bytes)
+                    yield stream.drain()
+            yield stream.drain()
+        except Exception as e:
+            print(f"Error exporting PDFs: {e}")
+            raise
+        finally:
+            cursor.close()
+
+    filename = f"quotes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+# ============================================
+# ASYNC PDF JOBS
+# ============================================
+
+PDF_JOB_CHANNEL = 'pdf_jobs'
+PDF_JOB_COLUMNS = "id, invoice_id, status, error, created_at, started_at, finished_at"
+# A job still 'running' after this many seconds is assumed lost and requeued
+PDF_JOB_TIMEOUT = int(os.environ.get('PDF_JOB_TIMEOUT', 300))
+PDF_JOB_RETENTION = int(os.environ.get('PDF_JOB_RETENTION', 86400))
+MAX_PDF_JOB_WAIT = 30
+
+_local_job_workers_pid = None
+
+def start_local_pdf_job_workers():
+    """Run PDF_JOB_LOCAL_WORKERS job threads in this process.
+
+    A stand-in for pdf_worker.py in development or single-process deploys.
+    """
+    global _local_job_workers_pid
+    count = int(os.environ.get('PDF_JOB_LOCAL_WORKERS', 0))
+    if count <= 0 or _local_job_workers_pid == os.getpid():
+        return
+    _local_job_workers_pid = os.getpid()
+    for i in range(count):
+        threading.Thread(target=run_pdf_job_worker, name=f'pdf-job-worker-{i}', daemon=True).start()
+
+def claim_pdf_job():
+    """Mark the oldest queued (or abandoned) job as running and return it"""
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f"""
+        UPDATE pdf_jobs SET status = 'running', started_at = now()
+        WHERE id = (
+            SELECT id FROM pdf_jobs
+            WHERE status = 'queued'
+               OR (status = 'running' AND started_at < now() - make_interval(secs => %s))
+            ORDER BY created_at
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING {PDF_JOB_COLUMNS}
+    """, (PDF_JOB_TIMEOUT,))
+    job = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return job
+
+def process_pdf_job(job):
+    """Render one claimed job and store the result (or the error) on its row"""
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        invoice = fetch_pdf_invoice(conn, job['invoice_id'])
+        if invoice is None:
+            raise Exception("Invoice not found")
+        settings = get_setting('company_settings', {})
+        job_summary_text = get_setting('job_summary', {"text": ""}).get('text', '')
+
+        key = pdf_cache_key(invoice, settings, job_summary_text)
+        pdf_bytes = pdf_cache.get(key)
+        if pdf_bytes is None:
+            pdf_bytes = generate_pdf(invoice, settings, job_summary_text).getvalue()
+            pdf_cache.put(key, pdf_bytes)
+
+        cursor.execute("""
+            UPDATE pdf_jobs SET status = 'done', result = %s, finished_at = now()
+            WHERE id = %s
+        """, (psycopg2.Binary(pdf_bytes), job['id']))
+    except Exception as e:
+        print(f"Error rendering PDF job {job['id']}: {e}")
+        conn.rollback()
+        cursor.execute("""
+            UPDATE pdf_jobs SET status = 'failed', error = %s, finished_at = now()
+            WHERE id = %s
+        """, (str(e), job['id']))
+    conn.commit()
+    cursor.close()
+
+def purge_pdf_jobs():
+    conn = get_db_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            DELETE FROM pdf_jobs
+            WHERE finished_at < now() - make_interval(secs => %s)
+        """, (PDF_JOB_RETENTION,))
+    conn.commit()
+
+def run_pdf_job_worker(idle_wait=5):
+    """Claim and render jobs forever, sleeping on LISTEN pdf_jobs when idle"""
+    last_purge = 0
+    while True:
+        listen_conn = None
+        try:
+            listen_conn = psycopg2.connect(get_pool().dsn)
+            listen_conn.autocommit = True
+            with listen_conn.cursor() as cur:
+                cur.execute(f"LISTEN {PDF_JOB_CHANNEL}")
+            while True:
+                with app.app_context():
+                    job = claim_pdf_job()
+                    if job:
+                        process_pdf_job(job)
+                        continue
+                    if time.monotonic() - last_purge > 3600:
+                        purge_pdf_jobs()
+                        last_purge = time.monotonic()
+                if select.select([listen_conn], [], [], idle_wait) != ([], [], []):
+                    listen_conn.poll()
+                    listen_conn.notifies.clear()
+        except Exception as e:
+            print(f"PDF job worker error: {e}")
+        finally:
+            if listen_conn is not None:
+                listen_conn.close()
+        time.sleep(5)
+
+def pdf_job_response(job):
+    job = dict(job)
+    if job['status'] == 'done':
+        job['result_url'] = f"/api/pdf-jobs/{job['id']}/pdf"
+    return job
+
+@app.route('/api/invoices/<invoice_id>/pdf-jobs', methods=['POST'])
+def create_pdf_job(invoice_id):
+    """Queue a PDF render and return the job for status polling"""
+    try:
+        start_local_pdf_job_workers()
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT 1 FROM invoices WHERE id = %s", (invoice_id,))
+        if not cursor.fetchone():
+            return jsonify({"error": "Invoice not found"}), 404
+        cursor.execute(f"""
+            INSERT INTO pdf_jobs (id, invoice_id) VALUES (%s, %s)
+            RETURNING {PDF_JOB_COLUMNS}
+        """, (str(uuid.uuid4()), invoice_id))
+        job = cursor.fetchone()
+        cursor.execute("SELECT pg_notify(%s, %s)", (PDF_JOB_CHANNEL, str(job['id'])))
+        conn.commit()
+        cursor.close()
+        return jsonify(pdf_job_response(job)), 202
+    except Exception as e:
+        print(f"Error queueing PDF job: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/pdf-jobs/<job_id>', methods=['GET'])
+def get_pdf_job(job_id):
+    """Job status; ``?wait=N`` long-polls up to N seconds (max 30) for completion"""
+    try:
+        wait_seconds = min(request.args.get('wait', 0, type=float), MAX_PDF_JOB_WAIT)
+        deadline = time.monotonic() + wait_seconds
+        delay = 0.25
+        while True:
+            conn = get_db_connection()
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"SELECT {PDF_JOB_COLUMNS} FROM pdf_jobs WHERE id = %s", (job_id,))
+                job = cursor.fetchone()
+            conn.rollback()
+            if not job:
+                return jsonify({"error": "Job not found"}), 404
+            if job['status'] in ('done', 'failed') or time.monotonic() + delay > deadline:
+                break
+            # Give the connection back while sleeping, so waiting pollers
+            # cannot drain the pool for the rest of the worker
+            release_db_connection(None)
+            time.sleep(delay)
+            delay = min(delay * 2, 2)
+        return jsonify(pdf_job_response(job))
+    except Exception as e:
+        print(f"Error fetching PDF job: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/pdf-jobs/<job_id>/pdf', methods=['GET'])
+def download_pdf_job(job_id):
+    """Download the PDF rendered by a finished job"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT j.status, j.result, i.quote_number, i.client_name
+            FROM pdf_jobs j LEFT JOIN invoices i ON i.id::text = j.invoice_id
+            WHERE j.id = %s
+        """, (job_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        if not row:
+            return jsonify({"error": "Job not found"}), 404
+        if row['status'] != 'done':
+            return jsonify({"error": f"Job is {row['status']}"}), 409
+        return send_file(
+            io.BytesIO(bytes(row['result'])),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=pdf_filename(dict(row))
+        )
+    except Exception as e:
+        print(f"Error downloading PDF job: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# ============================================
+# PDF GENERATION FUNCTION
+# ============================================
+
+def get_quote_template(quality=None):
+    """The process-wide QuoteTemplate (imports ReportLab on first use)"""
+    import pdf_render
+    logo_dpi, logo_quality = PDF_QUALITY_PRESETS[quality or PDF_QUALITY]
+    return pdf_render.get_quote_template(os.path.join(app.root_path, 'static', 'logo.jpg'),
+                                         logo_dpi, logo_quality)
+
+def generate_pdf(invoice, settings, job_summary_text, template=None, quality=None, out=None):
+    """Render a quote PDF into ``out`` or a new BytesIO; see pdf_render.generate_pdf"""
+    import pdf_render
+    buffer, flowables, build = pdf_render.generate_pdf(
+        invoice, settings, job_summary_text, template or get_quote_template(quality), out)
+    metrics.observe('pdf_render_seconds', flowables, phase='flowables')
+    metrics.observe('pdf_render_seconds', build, phase='build')
+    metrics.observe('pdf_size_bytes', buffer.tell(), buckets=Metrics.SIZE_BUCKETS,
+                    quality=quality or PDF_QUALITY)
+    record_timing('pdf_flowables', flowables)
+    record_timing('pdf_build', build)
     return buffer
+# ============================================
+# APP FACTORY
+# ============================================
+
+def warm_up():
+    """Build the static assets, import ReportLab and render a throwaway quote.
+
+    Builds the shared QuoteTemplate (styles, encoded logo) and loads fonts,
+    so the first real PDF request does not pay for them. Called before fork
+    (gunicorn --preload) the work is shared by every worker.
+    """
+    started = time.perf_counter()
+    get_static_assets()
+    import pdf_render
+    pdf_render.generate_pdf(
+        {'quote_number': 'WARMUP', 'created_at': '2024-01-01T00:00:00+11:00', 'total': 0,
+         'items': [{'name': 'Warm-up', 'quantity': 1, 'unit': 'unit', 'notes': 'n'}]},
+        {}, "# Warm-up\n## Warm-up\n* Warm-up", get_quote_template())
+    STARTUP_SECONDS['warm_up'] = time.perf_counter() - started
+
+def create_app(warm=None):
+    """Application factory: ``gunicorn 'app:create_app()'``.
+
+    Starts the background database check and, when ``warm`` (default: the
+    WARM_UP environment variable) is set, preloads the PDF stack. The routes
+    live on the module-level ``app``, so ``gunicorn app:app`` keeps working
+    with the check deferred to the first request.
+    """
+    if warm is None:
+        warm = os.environ.get('WARM_UP', '').lower() in ('1', 'true', 'yes')
+    if warm and 'warm_up' not in STARTUP_SECONDS:
+        warm_up()
+    start_database_check()
+    return app
+
+STARTUP_SECONDS['import'] = time.perf_counter() - _IMPORT_STARTED
+
 # ============================================
 # MAIN
 # ============================================
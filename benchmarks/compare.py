@@ -0,0 +1,33 @@
+"""Compare two result files written by benchmarks/run.py.
+
+    python benchmarks/compare.py before.json after.json
+"""
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_per_s', 'peak_heap_kb')
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    with open(sys.argv[1]) as f:
+        before = json.load(f)
+    with open(sys.argv[2]) as f:
+        after = json.load(f)
+
+    print(f"{before['meta'].get('commit')} -> {after['meta'].get('commit')}")
+    print(f"{'benchmark':<40} " + " ".join(f"{m:>18}" for m in METRICS))
+    for name, new in after['results'].items():
+        old = before['results'].get(name)
+        if old is None:
+            continue
+        cells = []
+        for metric in METRICS:
+            change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0.0
+            cells.append(f"{new[metric]:10.1f} {change:+6.1f}%")
+        print(f"{name:<40} " + " ".join(cells))
+
+
+if __name__ == '__main__':
+    main()
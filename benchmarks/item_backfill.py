@@ -0,0 +1,90 @@
+"""Check that legacy invoices keep their service attribution when the
+invoice_items table is first created and backfilled from the JSON items.
+
+Builds the pre-migration tables in the throwaway benchmark schema (see
+run.py), seeds invoices whose JSON items reference the catalog by key and
+by item id, runs init_database and checks the typed rows, report_services_live
+and GET /api/reports/revenue-by-service.
+
+    BENCH_DB_URL=postgresql://localhost/postgres python benchmarks/item_backfill.py
+"""
+import json
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from run import BASE_TABLES, BENCH_SCHEMA, SERVICES_PATH, SETTINGS  # noqa: E402
+
+# (item id, expected service_key, price); the second one is an item id
+# added to the catalog below, the last one is a custom line
+LEGACY_ITEMS = [
+    ("appliances.oven", "appliances.oven", 1200),
+    ("legacy-fridge", "appliances.fridge", 2500),
+    ("custom-123", None, 99),
+]
+
+
+def main():
+    db_url = os.environ.get('BENCH_DB_URL')
+    if not db_url:
+        sys.exit("BENCH_DB_URL is required")
+    import psycopg2
+    import psycopg2.extensions
+    from psycopg2.extras import Json
+
+    with open(SERVICES_PATH) as f:
+        services = json.load(f)
+    services['appliances']['items']['fridge']['id'] = 'legacy-fridge'
+
+    conn = psycopg2.connect(db_url)
+    with conn.cursor() as cur:
+        cur.execute(BASE_TABLES)
+        cur.execute("INSERT INTO settings VALUES ('services', %s, now()), ('company_settings', %s, now())",
+                    (Json(services), Json(SETTINGS)))
+        for i, (ref, _, price) in enumerate(LEGACY_ITEMS):
+            items = [{"id": ref, "name": f"Legacy line {i}", "quantity": 2, "unit": "unit",
+                      "price": price, "total": 2 * price}]
+            cur.execute("INSERT INTO invoices (id, quote_number, client_name, items, total) "
+                        "VALUES (%s, %s, 'Legacy Client', %s, %s)",
+                        (str(uuid.uuid4()), f"BN{i}", Json(items), 2 * price))
+    conn.commit()
+
+    os.environ['SUPABASE_DB_URL'] = psycopg2.extensions.make_dsn(
+        db_url, options=f'-c search_path={BENCH_SCHEMA}')
+    import app as invoice_app
+    failures = []
+    try:
+        if not invoice_app.init_database():
+            sys.exit("Could not prepare the benchmark schema")
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT catalog_id, service_key FROM {BENCH_SCHEMA}.invoice_items")
+            keys = dict(cur.fetchall())
+            cur.execute(f"SELECT service_key, revenue FROM {BENCH_SCHEMA}.report_services_live WHERE line_count > 0")
+            revenue = {key: float(value) for key, value in cur.fetchall()}
+        conn.commit()
+        for ref, expected, price in LEGACY_ITEMS:
+            if keys.get(ref) != expected:
+                failures.append(f"{ref}: service_key {keys.get(ref)!r}, expected {expected!r}")
+            if revenue.get(expected or '') != 2 * price:
+                failures.append(f"{ref}: report_services revenue {revenue.get(expected or '')!r}, expected {2 * price}")
+
+        response = invoice_app.app.test_client().get('/api/reports/revenue-by-service')
+        names = {row['service_key']: row['name'] for row in response.get_json()['services']}
+        if names.get('appliances.fridge') != 'Fridge':
+            failures.append(f"revenue-by-service names: {names}")
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+    for failure in failures:
+        print(failure)
+    print(f"{len(LEGACY_ITEMS)} legacy lines, {len(failures)} failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Compare JSON serialization and bytes on the wire for the API's largest
+payloads: Flask's default provider (with the old dict copies) against the
+app's orjson provider, plus the size and cost of gzip/brotli on top.
+
+    python benchmarks/json_payloads.py
+    python benchmarks/json_payloads.py --rows 100 1000 10000 --json json.json
+
+Invoice rows are built as RealDictCursor would return them (UUIDs,
+timestamptz, numeric totals, jsonb items), so no database is needed.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('SUPABASE_DB_URL', 'postgresql://unused')
+
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from psycopg2.extras import RealDictRow  # noqa: E402
+
+import app as invoice_app  # noqa: E402
+from run import SERVICES_PATH, make_items  # noqa: E402
+
+
+def make_rows(count, items_per_invoice=8):
+    items = make_items(items_per_invoice)
+    start = datetime(2024, 1, 1, 9, tzinfo=timezone.utc)
+    rows = []
+    for n in range(count):
+        row = RealDictRow()
+        row.update({
+            "id": uuid.uuid4(), "quote_number": f"BN{n}", "client_name": f"Client {n % 500}",
+            "client_number": f"0400 000 {n}", "project_notes": "Seeded for benchmarks",
+            "items": items, "total": Decimal(100 + n % 900).quantize(Decimal('0.01')),
+            "created_at": start + timedelta(minutes=n), "updated_at": None,
+        })
+        rows.append(row)
+    return rows
+
+
+def timed(fn, iterations):
+    fn()  # warm-up
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def bench_payload(name, payload, legacy_payload, iterations):
+    flask_app = invoice_app.app
+    default = DefaultJSONProvider(flask_app)
+    with flask_app.app_context():
+        body = default.response(legacy_payload()).get_data()
+        result = {
+            "default_ms": timed(lambda: default.response(legacy_payload()), iterations),
+            "fast_ms": None,
+            "identity_bytes": len(body),
+            "gzip_bytes": len(invoice_app.compress_body(body, 'gzip')),
+            "gzip_ms": timed(lambda: invoice_app.compress_body(body, 'gzip'), iterations),
+            "br_bytes": None,
+            "br_ms": None,
+        }
+        if invoice_app.orjson is not None:
+            fast = invoice_app.FastJSONProvider(flask_app)
+            assert json.loads(fast.response(payload).get_data()) == json.loads(body)
+            result["fast_ms"] = timed(lambda: fast.response(payload), iterations)
+        if invoice_app.brotli is not None:
+            result["br_bytes"] = len(invoice_app.compress_body(body, 'br'))
+            result["br_ms"] = timed(lambda: invoice_app.compress_body(body, 'br'), iterations)
+    return name, result
+
+
+def fmt(value, spec):
+    return format(value, spec) if value is not None else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON encode time and response size per provider")
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    with open(SERVICES_PATH) as f:
+        services = json.load(f)
+
+    report = dict([bench_payload("GET /api/services", services, lambda: services, args.iterations)])
+    for count in args.rows:
+        rows = make_rows(count)
+        iterations = max(3, args.iterations * 100 // max(count, 100))
+        name, result = bench_payload(f"GET /api/invoices rows={count}", rows,
+                                     lambda: [dict(row) for row in rows], iterations)
+        report[name] = result
+
+    print(f"{'payload':<30} {'default ms':>10} {'orjson ms':>10} {'bytes':>10} "
+          f"{'gzip':>9} {'gzip ms':>8} {'br':>9} {'br ms':>8}")
+    for name, r in report.items():
+        print(f"{name:<30} {r['default_ms']:>10.2f} {fmt(r['fast_ms'], '>10.2f')} {r['identity_bytes']:>10} "
+              f"{r['gzip_bytes']:>9} {r['gzip_ms']:>8.2f} {fmt(r['br_bytes'], '>9')} {fmt(r['br_ms'], '>8.2f')}")
+    print(f"(gzip level {invoice_app.COMPRESS_GZIP_LEVEL}, brotli quality {invoice_app.COMPRESS_BROTLI_QUALITY}; "
+          f"responses under {invoice_app.COMPRESS_MIN_BYTES} bytes are sent uncompressed)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
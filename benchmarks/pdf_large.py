@@ -0,0 +1,75 @@
+"""Time and peak RSS for rendering very large quotes, buffered vs streamed.
+
+    python benchmarks/pdf_large.py
+    python benchmarks/pdf_large.py --items 1000 10000 50000 --json large.json
+
+Each render runs in a fresh process so its peak RSS is its own. "buffered"
+renders an item list into a BytesIO, as for ordinary quotes; "streamed"
+takes items from a generator and spools the PDF to a temporary file, as
+GET /api/invoices/<id>/pdf does above PDF_STREAM_MIN_ITEMS line items.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('SUPABASE_DB_URL', 'postgresql://unused')
+
+MODES = ('buffered', 'streamed')
+
+
+def render(mode, count):
+    import app as invoice_app
+    from run import SETTINGS, make_invoice, make_item, make_items, make_summary
+
+    invoice_app.generate_pdf(make_invoice(make_items(5)), SETTINGS, make_summary(8))  # warm-up
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if mode == 'buffered':
+        invoice = make_invoice(make_items(count))
+        size = len(invoice_app.generate_pdf(invoice, SETTINGS, make_summary(8)).getvalue())
+    else:
+        invoice = make_invoice([])
+        invoice['items'] = (make_item(i) for i in range(count))
+        with tempfile.SpooledTemporaryFile(max_size=invoice_app.PDF_SPOOL_MAX_BYTES) as out:
+            invoice_app.generate_pdf(invoice, SETTINGS, make_summary(8), out=out)
+            size = out.tell()
+    seconds = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"seconds": seconds, "pdf_bytes": size, "base_rss_kb": base_kb,
+            "peak_rss_kb": peak_kb, "growth_kb": peak_kb - base_kb}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render time and memory for very large quotes")
+    parser.add_argument('--items', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'ITEMS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(render(args.child[0], int(args.child[1]))))
+        return
+
+    report = {}
+    print(f"{'items':>7} {'mode':<9} {'seconds':>8} {'pdf bytes':>10} {'peak RSS MB':>12} {'growth MB':>10}")
+    for count in args.items:
+        for mode in args.modes:
+            out = subprocess.run([sys.executable, __file__, '--child', mode, str(count)],
+                                 check=True, capture_output=True, text=True).stdout
+            r = report.setdefault(mode, {})[count] = json.loads(out.splitlines()[-1])
+            print(f"{count:>7} {mode:<9} {r['seconds']:>8.2f} {r['pdf_bytes']:>10} "
+                  f"{r['peak_rss_kb'] / 1024:>12.1f} {r['growth_kb'] / 1024:>10.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Check that quotes render at every position of the items table on a page.
+
+Sweeps the job summary length (the shipped data/job_summary.txt plus extra
+bullet lines, and benchmark summaries) so the items table starts at every
+point down a page, including the last few points, and checks each render
+succeeds and still shows every item and the totals.
+
+    python benchmarks/pdf_pagination.py
+    python benchmarks/pdf_pagination.py --extra-lines 200 --items 0 1 3 40
+"""
+import argparse
+import os
+import re
+import sys
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('SUPABASE_DB_URL', 'postgresql://unused')
+
+import app as invoice_app  # noqa: E402
+from run import SETTINGS, make_invoice, make_items, make_summary  # noqa: E402
+
+SUMMARY_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'job_summary.txt')
+
+
+def page_text(pdf):
+    """Text shown on each page (the page streams are Flate-compressed)"""
+    text = []
+    for match in re.finditer(rb'/Length (\d+)\s*>>\s*stream\r?\n', pdf):
+        raw = pdf[match.end():match.end() + int(match.group(1))]
+        try:
+            content = zlib.decompress(raw)
+        except zlib.error:
+            continue  # the logo
+        text.append(b' '.join(re.findall(rb'\(((?:[^()\\]|\\.)*)\) Tj', content)))
+    return text
+
+
+def check(n_items, summary):
+    """None if the quote renders completely, else what went wrong"""
+    try:
+        pdf = invoice_app.generate_pdf(make_invoice(make_items(n_items)), SETTINGS, summary).getvalue()
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    text = b' '.join(page_text(pdf))
+    if n_items and f"Line item {n_items - 1}".encode() not in text:
+        return "last item missing"
+    if b'Total:' not in text:
+        return "totals missing"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render quotes with the items table at every page position")
+    parser.add_argument('--items', type=int, nargs='+', default=[0, 1, 3, 40])
+    parser.add_argument('--extra-lines', type=int, default=130)
+    args = parser.parse_args()
+
+    with open(SUMMARY_PATH) as f:
+        shipped = f.read()
+    summaries = [(f"job_summary.txt + {n} bullets", shipped + ''.join(f"\n* Extra line {i}" for i in range(n)))
+                 for n in range(args.extra_lines)]
+    summaries += [(f"{n} summary lines", make_summary(n)) for n in range(args.extra_lines)]
+
+    failures = []
+    for n_items in args.items:
+        for label, summary in summaries:
+            problem = check(n_items, summary)
+            if problem:
+                failures.append(f"{n_items} items, {label}: {problem}")
+    print(f"{len(args.items) * len(summaries)} renders, {len(failures)} failed")
+    for failure in failures:
+        print(f"  {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Report the size of generated quote PDFs for each PDF_QUALITY preset.
+
+    python benchmarks/pdf_size.py
+    python benchmarks/pdf_size.py --items 1 20 200 --json sizes.json
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('SUPABASE_DB_URL', 'postgresql://unused')
+
+import app as invoice_app  # noqa: E402
+from run import SETTINGS, make_invoice, make_items, make_summary  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per quote for each PDF quality preset")
+    parser.add_argument('--items', type=int, nargs='+', default=[1, 10, 50, 500])
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = {}
+    for quality in invoice_app.PDF_QUALITY_PRESETS:
+        template = invoice_app.get_quote_template(quality)
+        logo = template.logo_xobject
+        report[quality] = {
+            "logo_bytes": len(logo.streamContent) if logo is not None else 0,
+            "logo_pixels": f"{logo.width}x{logo.height}" if logo is not None else None,
+            "pdf_bytes": {},
+        }
+        for count in args.items:
+            pdf = invoice_app.generate_pdf(make_invoice(make_items(count)), SETTINGS, make_summary(8),
+                                           quality=quality).getvalue()
+            report[quality]["pdf_bytes"][count] = len(pdf)
+
+    print(f"{'quality':<10} {'logo':>12} {'logo bytes':>11} " + " ".join(f"{f'{n} items':>11}" for n in args.items))
+    for quality, row in report.items():
+        print(f"{quality:<10} {row['logo_pixels'] or '-':>12} {row['logo_bytes']:>11} "
+              + " ".join(f"{size:>11}" for size in row['pdf_bytes'].values()))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
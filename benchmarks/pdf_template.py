@@ -0,0 +1,71 @@
+"""Micro-benchmark: generate_pdf with the shared QuoteTemplate vs a fresh one.
+
+A fresh QuoteTemplate per call reproduces the old behaviour of rebuilding
+every style and re-reading the logo on each render.
+
+    python benchmarks/pdf_template.py [renders] [items]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app as invoice_app
+import pdf_render
+
+SETTINGS = {
+    "company_name": "Benchmark Pty Ltd",
+    "abn": "12 345 678 901",
+    "phone": "02 9999 9999",
+    "email": "quotes@example.com",
+    "address": "1 Example St, Sydney NSW",
+    "area_manager": "A. Manager",
+    "bank_account_name": "Benchmark Pty Ltd",
+    "bank_bsb": "062-000",
+    "bank_account": "12345678",
+}
+SUMMARY = "# Scope\n## Kitchen\n* Remove existing cabinets\n* Install new benchtops\nAll work to AS/NZS 3000."
+
+
+def make_invoice(n_items):
+    return {
+        "id": "bench",
+        "quote_number": "JN5401",
+        "client_name": "Bench Client",
+        "client_number": "0400 000 000",
+        "created_at": "2024-01-01T09:00:00+11:00",
+        "total": 1234.5,
+        "items": [
+            {"name": f"Item {i}", "quantity": 2, "unit": "hour",
+             "notes": "Check access" if i % 3 == 0 else ""}
+            for i in range(n_items)
+        ],
+    }
+
+
+def run(label, renders, invoice, template_factory):
+    invoice_app.generate_pdf(invoice, SETTINGS, SUMMARY, template=template_factory())  # warm-up
+    start = time.perf_counter()
+    for _ in range(renders):
+        invoice_app.generate_pdf(invoice, SETTINGS, SUMMARY, template=template_factory())
+    per_render = (time.perf_counter() - start) / renders * 1000
+    print(f"{label:<22} {per_render:8.2f} ms/render")
+    return per_render
+
+
+def main():
+    renders = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_items = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    invoice = make_invoice(n_items)
+    logo_path = os.path.join(invoice_app.app.root_path, 'static', 'logo.jpg')
+
+    print(f"{renders} renders, {n_items} line items")
+    logo_settings = invoice_app.PDF_QUALITY_PRESETS[invoice_app.PDF_QUALITY]
+    before = run("fresh template", renders, invoice, lambda: pdf_render.QuoteTemplate(logo_path, *logo_settings))
+    after = run("shared template", renders, invoice, invoice_app.get_quote_template)
+    print(f"saved {before - after:.2f} ms/render ({(1 - after / before) * 100:.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
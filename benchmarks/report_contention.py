@@ -0,0 +1,123 @@
+"""Concurrent invoice creates against the reporting rollup triggers.
+
+Every create lands in the same month (and here the same client), so if the
+triggers wrote the rollup rows directly each transaction would hold those
+row locks until commit and creates would run one at a time. They only
+append deltas, so the creates should overlap. Each transaction sleeps
+between the invoice and items inserts to stand in for the rest of
+create_invoice's round trips.
+
+Runs in the throwaway benchmark schema (see run.py), then folds the deltas
+and checks the live and folded rollups against the base tables.
+
+    BENCH_DB_URL=postgresql://localhost/postgres python benchmarks/report_contention.py
+    BENCH_DB_URL=... python benchmarks/report_contention.py --threads 16 --creates 20 --hold-ms 20
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from run import BASE_TABLES, BENCH_SCHEMA, SETTINGS  # noqa: E402
+
+
+def rollup_mismatches(cur, suffix):
+    """Differences between the base tables and the report_*{suffix} rollups"""
+    cur.execute(f"""
+        SELECT (SELECT count(*) FROM invoices), (SELECT sum(total::numeric) FROM invoices),
+               (SELECT sum(invoice_count) FROM report_monthly{suffix}), (SELECT sum(revenue) FROM report_monthly{suffix}),
+               (SELECT sum(invoice_count) FROM report_clients{suffix}), (SELECT sum(revenue) FROM report_clients{suffix}),
+               (SELECT count(*) FROM invoice_items), (SELECT sum(line_total) FROM invoice_items),
+               (SELECT sum(line_count) FROM report_services{suffix}), (SELECT sum(revenue) FROM report_services{suffix})
+    """)
+    row = cur.fetchone()
+    invoices, items = row[0:2], row[6:8]
+    found = [f"report_{name}{suffix} has {value}, invoices have {invoices}"
+             for name, value in (('monthly', row[2:4]), ('clients', row[4:6])) if value != invoices]
+    if row[8:10] != items:
+        found.append(f"report_services{suffix} has {row[8:10]}, invoice_items have {items}")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Time concurrent creates under the report triggers")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--creates', type=int, default=25, help="creates per thread")
+    parser.add_argument('--hold-ms', type=float, default=10, help="time each transaction stays open")
+    args = parser.parse_args()
+
+    db_url = os.environ.get('BENCH_DB_URL')
+    if not db_url:
+        sys.exit("BENCH_DB_URL is required")
+    import psycopg2
+    import psycopg2.extensions
+    from psycopg2.extras import Json
+
+    conn = psycopg2.connect(db_url)
+    with conn.cursor() as cur:
+        cur.execute(BASE_TABLES)
+        cur.execute("INSERT INTO settings VALUES ('company_settings', %s, now())", (Json(SETTINGS),))
+    conn.commit()
+    dsn = psycopg2.extensions.make_dsn(db_url, options=f'-c search_path={BENCH_SCHEMA}')
+    os.environ['SUPABASE_DB_URL'] = dsn
+    import app as invoice_app
+
+    failures = []
+    try:
+        if not invoice_app.init_database():
+            sys.exit("Could not prepare the benchmark schema")
+
+        def create(worker):
+            writer = psycopg2.connect(dsn)
+            with writer.cursor() as cur:
+                for _ in range(args.creates):
+                    invoice_id = str(uuid.uuid4())
+                    cur.execute("INSERT INTO invoices (id, quote_number, client_name, items, total) "
+                                "VALUES (%s, 'BN' || nextval('quote_number_seq'), 'Contended Client', '[]', 170)",
+                                (invoice_id,))
+                    cur.execute("SELECT pg_sleep(%s)", (args.hold_ms / 1000,))
+                    cur.execute("INSERT INTO invoice_items (invoice_id, position, name, quantity, price, line_total) "
+                                "VALUES (%s, 0, 'Labour', 2, 85, 170)", (invoice_id,))
+                    writer.commit()
+            writer.close()
+
+        threads = [threading.Thread(target=create, args=(i,)) for i in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        count = args.threads * args.creates
+        serial = count * args.hold_ms / 1000
+        print(f"{count} creates on {args.threads} threads in {elapsed:.2f}s "
+              f"({count / elapsed:.0f}/s); one at a time would take at least {serial:.2f}s")
+        if elapsed >= serial:
+            failures.append("creates ran one at a time")
+
+        # This connection's search_path is the benchmark schema (BASE_TABLES)
+        with conn.cursor() as cur:
+            failures += rollup_mismatches(cur, '_live')
+            cur.execute("SELECT report_fold()")
+            cur.execute("SELECT count(*) FROM report_invoice_deltas")
+            if cur.fetchone()[0]:
+                failures.append("report_fold left deltas behind")
+            failures += rollup_mismatches(cur, '')
+        conn.commit()
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""Performance benchmarks for the API routes and PDF generation.
+
+Route benchmarks go through the Flask test client against a real Postgres
+given by BENCH_DB_URL. Everything runs in a throwaway ``invoice_bench``
+schema that is dropped and recreated on each run, so the database's own
+tables are never touched. Without BENCH_DB_URL only the PDF benchmarks run.
+
+    BENCH_DB_URL=postgresql://localhost/postgres python benchmarks/run.py
+    python benchmarks/run.py --quick --only pdf --out before.json
+    python benchmarks/compare.py before.json after.json
+
+Startup benchmarks time fresh interpreters importing the app (and
+rendering a first PDF), which is what a new gunicorn worker pays.
+
+Each benchmark reports throughput, p50/p95/p99 latency and the peak Python
+heap (tracemalloc) of one extra, separately measured call.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+BENCH_SCHEMA = 'invoice_bench'
+
+# The base tables are created by hand in Supabase; mirror them here
+BASE_TABLES = f"""
+    DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;
+    CREATE SCHEMA {BENCH_SCHEMA};
+    SET search_path = {BENCH_SCHEMA};
+    CREATE TABLE settings (
+        key text PRIMARY KEY,
+        value jsonb,
+        updated_at timestamptz
+    );
+    CREATE TABLE services (id serial PRIMARY KEY);
+    CREATE TABLE invoices (
+        id uuid PRIMARY KEY,
+        quote_number text,
+        client_name text,
+        client_number text,
+        project_notes text,
+        items jsonb,
+        total numeric,
+        created_at timestamptz DEFAULT now(),
+        updated_at timestamptz
+    );
+"""
+
+SEED_INVOICES = f"""
+    INSERT INTO {BENCH_SCHEMA}.invoices
+        (id, quote_number, client_name, client_number, project_notes, items, total, created_at)
+    SELECT gen_random_uuid(), 'BN' || n, 'Client ' || (n %% 500), '0400 000 ' || n,
+           'Seeded for benchmarks', %s::jsonb, 100 + n %% 900,
+           now() - make_interval(mins => n)
+    FROM generate_series(1, %s) AS n
+"""
+
+SEED_INVOICE_ITEMS = f"""
+    INSERT INTO {BENCH_SCHEMA}.invoice_items
+        (invoice_id, position, catalog_id, name, quantity, unit, price, line_total, notes)
+    SELECT i.id, e.ordinality - 1, e.item->>'id', e.item->>'name', (e.item->>'quantity')::numeric,
+           e.item->>'unit', (e.item->>'price')::numeric, (e.item->>'total')::numeric, e.item->>'notes'
+    FROM {BENCH_SCHEMA}.invoices i, jsonb_array_elements(i.items) WITH ORDINALITY AS e(item, ordinality)
+"""
+
+SETTINGS = {
+    "quote_prefix": "BN",
+    "next_quote_number": 1,
+    "company_name": "Benchmark Pty Ltd",
+    "abn": "12 345 678 901",
+    "phone": "02 9999 9999",
+    "email": "quotes@example.com",
+    "address": "1 Example St, Sydney NSW",
+    "area_manager": "A. Manager",
+    "bank_account_name": "Benchmark Pty Ltd",
+    "bank_bsb": "062-000",
+    "bank_account": "12345678",
+}
+
+SERVICES_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'services.json')
+
+
+def make_item(i):
+    return {"id": f"item-{i}", "name": f"Line item {i}", "quantity": 1 + i % 4,
+            "unit": "hour", "price": 85, "total": 85 * (1 + i % 4),
+            "notes": "Confirm access with site manager" if i % 5 == 0 else ""}
+
+
+def make_items(count):
+    return [make_item(i) for i in range(count)]
+
+
+def make_summary(lines):
+    parts = []
+    for i in range(lines):
+        parts.append(["# Stage {i}", "## Kitchen {i}", "* Remove and dispose of item {i}",
+                      "Install and test fixture {i} to AS/NZS 3000."][i % 4].format(i=i))
+    return '\n'.join(parts)
+
+
+def make_invoice(items):
+    return {
+        "id": "bench", "quote_number": "BN1", "client_name": "Bench Client",
+        "client_number": "0400 000 000", "created_at": "2024-01-01T09:00:00+11:00",
+        "total": sum(item["total"] for item in items), "items": items,
+    }
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(name, fn, iterations, results):
+    fn()  # warm-up
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results[name] = {
+        "iterations": iterations,
+        "throughput_per_s": iterations / elapsed,
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "peak_heap_kb": peak / 1024,
+    }
+    r = results[name]
+    print(f"{name:<40} {r['throughput_per_s']:9.1f}/s  p50 {r['p50_ms']:8.2f}  "
+          f"p95 {r['p95_ms']:8.2f}  p99 {r['p99_ms']:8.2f} ms  heap {r['peak_heap_kb']:9.0f} KB")
+
+
+def check(response, status=200):
+    if response.status_code != status:
+        raise RuntimeError(f"{response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def bench_pdf(invoice_app, results, scale):
+    item_counts = [1, 50, 500] if scale < 1 else [1, 50, 500, 5000]
+    for count in item_counts:
+        invoice = make_invoice(make_items(count))
+        iterations = max(3, int(min(50, 20000 // (count + 100)) * scale))
+        measure(f"generate_pdf items={count}", lambda: invoice_app.generate_pdf(invoice, SETTINGS, make_summary(8)),
+                iterations, results)
+    for lines in (100, 1000):
+        invoice = make_invoice(make_items(10))
+        summary = make_summary(lines)
+        measure(f"generate_pdf summary_lines={lines}",
+                lambda: invoice_app.generate_pdf(invoice, SETTINGS, summary),
+                max(3, int(20 * scale) if lines == 100 else int(5 * scale)), results)
+
+
+def bench_routes(invoice_app, conn, results, scale):
+    client = invoice_app.app.test_client()
+    with open(SERVICES_PATH) as f:
+        services = json.load(f)
+
+    check(client.put('/api/company-settings', json=SETTINGS))
+    check(client.put('/api/services', json=services))
+    check(client.put('/api/job-summary', json={"summary": make_summary(12)}))
+
+    measure("GET /api/company-settings", lambda: check(client.get('/api/company-settings')),
+            int(500 * scale), results)
+    measure("GET /api/services", lambda: check(client.get('/api/services')), int(500 * scale), results)
+    measure("PUT /api/company-settings", lambda: check(client.put('/api/company-settings', json=SETTINGS)),
+            int(100 * scale), results)
+
+    body = {"clientName": "Bench Client", "clientNumber": "0400", "projectNotes": "Bench",
+            "items": make_items(10), "total": 1700}
+    created = []
+    measure("POST /api/invoices",
+            lambda: created.append(check(client.post('/api/invoices', json=body), 201).get_json()['id']),
+            int(200 * scale), results)
+    invoice_id = created[0]
+    measure("PUT /api/invoices/<id>",
+            lambda: check(client.put(f'/api/invoices/{invoice_id}', json=body)), int(200 * scale), results)
+    patch = {"items": [{"op": "replace", "index": 3, "item": {"quantity": 2}}]}
+    measure("PATCH /api/invoices/<id> one line",
+            lambda: check(client.patch(f'/api/invoices/{invoice_id}', json=patch, headers={'If-Match': '*'})),
+            int(200 * scale), results)
+
+    seed_items = json.dumps(make_items(10))
+    for rows in (10, 1000, 100000):
+        if scale < 1 and rows > 1000:
+            break
+        with conn.cursor() as cur:
+            cur.execute(f"TRUNCATE {BENCH_SCHEMA}.invoices CASCADE")
+            cur.execute(SEED_INVOICES, (seed_items, rows))
+            cur.execute(SEED_INVOICE_ITEMS)
+            cur.execute(f"ANALYZE {BENCH_SCHEMA}.invoices, {BENCH_SCHEMA}.invoice_items")
+        conn.commit()
+        full_iterations = max(3, int(min(200, 100000 // rows) * scale))
+        measure(f"GET /api/invoices rows={rows}", lambda: check(client.get('/api/invoices')),
+                full_iterations, results)
+        measure(f"GET /api/invoices?limit=50 rows={rows}",
+                lambda: check(client.get('/api/invoices?limit=50&fields=id,quote_number,client_name,total,created_at')),
+                int(200 * scale), results)
+        measure(f"GET /api/invoices/search rows={rows}",
+                lambda: check(client.get('/api/invoices/search?q=client+42&limit=20')), int(200 * scale), results)
+        measure(f"GET /api/invoices/bulk rows={rows}", lambda: check(client.get('/api/invoices/bulk')).get_data(),
+                max(3, int(min(50, 100000 // rows) * scale)), results)
+
+    import_body = '\n'.join(json.dumps({"client_name": f"Import {i}", "items": make_items(10)})
+                            for i in range(1000))
+    measure("POST /api/invoices/bulk rows=1000",
+            lambda: check(client.post('/api/invoices/bulk', data=import_body, content_type='application/x-ndjson')),
+            max(3, int(10 * scale)), results)
+
+
+COLD_START_SNIPPETS = {
+    "import app": "import app",
+    "import app + first PDF": "import app; app.generate_pdf({'items': []}, {}, '')",
+    "import app + warm_up": "import app; app.warm_up()",
+}
+
+
+def bench_cold_start(results, scale):
+    """Fresh interpreters importing the app, as a new gunicorn worker would"""
+    root = os.path.join(os.path.dirname(__file__), '..')
+    env = dict(os.environ, SUPABASE_DB_URL=os.environ.get('SUPABASE_DB_URL', 'postgresql://unused'))
+    for name, snippet in COLD_START_SNIPPETS.items():
+        measure(f"cold start: {name}",
+                lambda: subprocess.run([sys.executable, '-c', snippet], cwd=root, env=env, check=True,
+                                       stdout=subprocess.DEVNULL),
+                max(3, int(10 * scale)), results)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(__file__), text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the invoice-app benchmarks")
+    parser.add_argument('--out', default=None, help="JSON results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--quick', action='store_true', help="fewer iterations, skip the largest cases")
+    parser.add_argument('--only', choices=['pdf', 'routes', 'startup'], help="run one group only")
+    args = parser.parse_args()
+    scale = 0.2 if args.quick else 1.0
+
+    db_url = os.environ.get('BENCH_DB_URL')
+    conn = None
+    if db_url and args.only in (None, 'routes'):
+        import psycopg2
+        import psycopg2.extensions
+        conn = psycopg2.connect(db_url)
+        with conn.cursor() as cur:
+            cur.execute(BASE_TABLES)
+        conn.commit()
+        # Point the app at the benchmark schema before it is imported
+        os.environ['SUPABASE_DB_URL'] = psycopg2.extensions.make_dsn(
+            db_url, options=f'-c search_path={BENCH_SCHEMA}')
+    elif args.only in (None, 'routes'):
+        print("BENCH_DB_URL not set: skipping route benchmarks")
+
+    results = {}
+    if args.only in (None, 'startup'):
+        bench_cold_start(results, scale)
+
+    import app as invoice_app
+    if conn is not None and not invoice_app.init_database():
+        sys.exit("Could not prepare the benchmark schema")
+
+    if args.only in (None, 'pdf'):
+        bench_pdf(invoice_app, results, scale)
+    if conn is not None:
+        bench_routes(invoice_app, conn, results, scale)
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(os.path.dirname(__file__), 'results', f"{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out}")
+
+
+if __name__ == '__main__':
+    main()
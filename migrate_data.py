@@ -1,22 +1,47 @@
+"""Load the legacy JSON data (data/*.json) into the database.
+
+With SUPABASE_DB_URL set, everything (services, company settings, the job
+summary and data/invoices.json) is written straight to Postgres; otherwise
+the settings documents go through the Supabase REST API as before.
+
+    SUPABASE_DB_URL=... python migrate_data.py --dry-run
+    SUPABASE_DB_URL=... python migrate_data.py --batch-size 1000
+    SUPABASE_DB_URL=... python migrate_data.py --restart   # ignore the checkpoint
+
+Invoices are read incrementally and loaded in batches of one transaction
+each. After every batch the position is written to a checkpoint file, so an
+interrupted run picks up where it stopped; invoices whose id already exists
+are skipped either way. Invoices without an id get one derived from the
+file and their position in it, so a re-run skips those too.
+"""
+import argparse
 import json
 import os
-from supabase import create_client, Client
+import time
+import uuid
 
 # --- CONFIGURATION ---
 
 SUPABASE_URL = 'https://iqqczpmvqiuqrtnzusqx.supabase.co'
 SUPABASE_KEY = "sb_publishable_7EhrzbtM43LQrNFCY019UQ_KKKjCino"
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+DATA_DIR = 'data'
+CHECKPOINT_FILE = '.migrate_checkpoint.json'
+READ_CHUNK = 64 * 1024
+
 
 def migrate():
+    from supabase import create_client, Client
+
+    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
     print("Starting migration...")
 
     # 1. Migrate Services
     if os.path.exists('data/services.json'):
         with open('data/services.json', 'r') as f:
             services_data = json.load(f)
-        
+
         # We store services in the 'settings' table with key='services'
         # This is cleaner than a separate table for a single object
         supabase.table('settings').upsert({
@@ -31,7 +56,7 @@ def migrate():
     if os.path.exists('data/company_settings.json'):
         with open('data/company_settings.json', 'r') as f:
             settings_data = json.load(f)
-        
+
         supabase.table('settings').upsert({
             'key': 'company_settings',
             'value': settings_data
@@ -45,7 +70,7 @@ def migrate():
     if os.path.exists('data/job_summary.txt'):
         with open('data/job_summary.txt', 'r') as f:
             summary_text = f.read()
-        
+
         supabase.table('settings').upsert({
             'key': 'job_summary',
             'value': {"text": summary_text}
@@ -54,5 +79,215 @@ def migrate():
     else:
         print("⚠️ data/job_summary.txt not found.")
 
+# ============================================
+# DIRECT POSTGRES MIGRATION
+# ============================================
+
+def iter_json_array(path, chunk_size=READ_CHUNK):
+    """Yield the elements of a top-level JSON array without loading the file"""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"{path}: expected a JSON array")
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                element, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # Most likely an element cut off at the end of the buffer
+                if eof:
+                    raise
+                more = f.read(chunk_size)
+                eof = not more
+                buffer += more
+                continue
+            yield element
+            buffer = buffer[end:]
+            if len(buffer) < chunk_size and not eof:
+                more = f.read(chunk_size)
+                eof = not more
+                buffer += more
+
+
+def load_checkpoint(path, source):
+    """Invoices already loaded from ``source`` by an earlier run"""
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    stat = os.stat(source)
+    if checkpoint.get('source') != os.path.abspath(source) or checkpoint.get('size') != stat.st_size \
+            or checkpoint.get('mtime') != stat.st_mtime:
+        print("⚠️ Checkpoint is for a different invoices file; starting from the beginning.")
+        return 0
+    return checkpoint.get('done', 0)
+
+
+def save_checkpoint(path, source, done):
+    stat = os.stat(source)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({"source": os.path.abspath(source), "size": stat.st_size,
+                   "mtime": stat.st_mtime, "done": done}, f)
+    os.replace(tmp, path)
+
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        print(f"⚠️ {path} not found.")
+        return default
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# Tables a dry run reads; it checks they exist instead of creating the schema
+DRY_RUN_TABLES = ('invoices', 'settings', 'services')
+
+
+def check_database(invoice_app):
+    """Read-only connectivity and schema check for --dry-run"""
+    try:
+        with invoice_app.app.app_context():
+            conn = invoice_app.get_db_connection()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.execute("SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NULL",
+                               (list(DRY_RUN_TABLES),))
+                missing = [name for (name,) in cursor.fetchall()]
+            conn.rollback()
+    except Exception as e:
+        raise SystemExit(f"❌ Cannot reach the database: {e}")
+    if missing:
+        raise SystemExit(f"❌ Missing tables: {', '.join(missing)}")
+
+
+def migrate_direct(args):
+    import app as invoice_app
+
+    if args.dry_run:
+        check_database(invoice_app)
+    elif not invoice_app.init_database():
+        raise SystemExit("❌ Cannot reach the database")
+    data_dir = args.data_dir
+    services = read_json(os.path.join(data_dir, 'services.json'))
+    company_settings = read_json(os.path.join(data_dir, 'company_settings.json'))
+    summary_path = os.path.join(data_dir, 'job_summary.txt')
+    summary_text = None
+    if os.path.exists(summary_path):
+        with open(summary_path, 'r') as f:
+            summary_text = f.read()
+
+    with invoice_app.app.app_context():
+        conn = invoice_app.get_db_connection()
+        documents = [('services', services), ('company_settings', company_settings),
+                     ('job_summary', {"text": summary_text} if summary_text is not None else None)]
+        for key, value in documents:
+            if value is None:
+                continue
+            if args.dry_run:
+                print(f"[dry run] would write {key}")
+            elif invoice_app.set_setting(key, value):
+                print(f"✅ {key} migrated.")
+            else:
+                raise SystemExit(f"❌ Failed to write {key}")
+
+        invoices_path = os.path.join(data_dir, 'invoices.json')
+        if not os.path.exists(invoices_path):
+            print(f"⚠️ {invoices_path} not found.")
+            return
+
+        settings = company_settings or invoice_app.get_setting('company_settings', {'quote_prefix': 'JN'})
+        quote_prefix = settings.get('quote_prefix', 'JN')
+        catalog = invoice_app.ServiceCatalog(services, None) if services else invoice_app.get_catalog()
+        now = invoice_app.sydney_now().isoformat()
+        checkpoint_path = os.path.join(data_dir, CHECKPOINT_FILE)
+        done = 0 if args.restart or args.dry_run else load_checkpoint(checkpoint_path, invoices_path)
+        if done:
+            print(f"Resuming after {done} invoices.")
+
+        source_url = f"file://{os.path.realpath(invoices_path)}"
+        stats = {"read": 0, "inserted": 0, "existing": 0, "invalid": 0}
+        highest = int(settings.get('next_quote_number') or 0) - 1
+        batch = []
+        started = time.perf_counter()
+        size = os.path.getsize(invoices_path)
+
+        def flush(position):
+            nonlocal highest
+            if args.dry_run:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT count(*) FROM invoices WHERE id IN %s",
+                                   (tuple(row['id'] for row in batch),))
+                    existing = cursor.fetchone()[0]
+                conn.rollback()
+                inserted = len(batch) - existing
+            else:
+                inserted = invoice_app.import_invoice_batch(conn, batch, quote_prefix, now)
+                save_checkpoint(checkpoint_path, invoices_path, position)
+            stats['inserted'] += inserted
+            stats['existing'] += len(batch) - inserted
+            for row in batch:
+                suffix = (row['quote_number'] or '')[len(quote_prefix):]
+                if (row['quote_number'] or '').startswith(quote_prefix) and suffix.isdigit():
+                    highest = max(highest, int(suffix))
+            batch.clear()
+            elapsed = time.perf_counter() - started
+            print(f"  {position} invoices  {stats['read'] / elapsed:8.0f}/s", flush=True)
+
+        position = 0
+        for position, row in enumerate(iter_json_array(invoices_path), 1):
+            if position <= done:
+                continue
+            stats['read'] += 1
+            try:
+                batch.append(invoice_app.prepare_import_row(
+                    row, catalog, uuid.uuid5(uuid.NAMESPACE_URL, f"{source_url}#{position}")))
+            except (ValueError, TypeError, ArithmeticError) as e:
+                stats['invalid'] += 1
+                print(f"⚠️ invoice #{position} skipped: {e}")
+            if len(batch) >= args.batch_size:
+                flush(position)
+        if batch:
+            flush(position)
+        elif stats['read'] and not args.dry_run:
+            save_checkpoint(checkpoint_path, invoices_path, position)
+
+        # Keep new quote numbers clear of the migrated ones
+        if not args.dry_run:
+            invoice_app.raise_next_quote_number(highest + 1)
+            conn.commit()
+
+        elapsed = time.perf_counter() - started
+        label = "[dry run] " if args.dry_run else ""
+        verb = "would insert" if args.dry_run else "inserted"
+        print(f"{label}✅ Invoices: {stats['read']} read, {verb} {stats['inserted']}, "
+              f"{stats['existing']} already present, {stats['invalid']} invalid")
+        print(f"{label}{elapsed:.1f}s, {stats['read'] / elapsed if elapsed else 0:.0f} invoices/s, "
+              f"{size / 1e6 / elapsed if elapsed else 0:.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the legacy JSON data")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--batch-size', type=int, default=1000, help="invoices per transaction")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="parse and validate everything and report what would change, without writing")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and start over")
+    args = parser.parse_args()
+
+    if os.environ.get('SUPABASE_DB_URL'):
+        migrate_direct(args)
+    elif args.dry_run:
+        raise SystemExit("--dry-run needs SUPABASE_DB_URL")
+    else:
+        migrate()
+
+
 if __name__ == "__main__":
-    migrate()
\ No newline at end of file
+    main()
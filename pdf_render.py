@@ -0,0 +1,422 @@
+"""Quote PDF rendering with ReportLab.
+
+Kept out of app.py so web workers only import ReportLab when they render
+their first PDF (see ``app.generate_pdf``), or ahead of time in ``warm_up``.
+"""
+import copy
+import hashlib
+import io
+import itertools
+import json
+import os
+import time
+from datetime import datetime
+
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Flowable, PageBreak
+from reportlab.pdfbase.pdfdoc import PDFImageXObject, PDFStream, PDFDictionary, PDFArray, PDFName, PDFZCompress
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.lib.units import mm
+from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
+from PIL import Image as PILImage
+
+# Streams are written as raw binary: ASCII85 (ReportLab's default) makes
+# every compressed page and image a quarter larger for no benefit here
+rl_config.useA85 = 0
+
+LOGO_SIZE = (70*mm, 40*mm)
+
+ITEM_COLUMN_WIDTHS = [15*mm, 135*mm, 30*mm]
+ITEM_HEADER = ['NO.', 'DESCRIPTION', 'QTY']
+# No items table row is shorter than this (one line of text plus padding);
+# ItemsTable takes availHeight / this many rows as a page's candidates
+MIN_ITEM_ROW_HEIGHT = 12
+
+def encode_logo(logo_path, dpi=None, quality=None):
+    """JPEG bytes for the logo, resampled to ``dpi`` at its drawn size.
+
+    Without ``dpi`` (or when the source is already small enough) the file is
+    used unchanged if it is a JPEG.
+    """
+    with open(logo_path, 'rb') as f:
+        source = f.read()
+    image = PILImage.open(io.BytesIO(source))
+    target = (round(LOGO_SIZE[0] / 72 * dpi), round(LOGO_SIZE[1] / 72 * dpi)) if dpi else image.size
+    if image.format == 'JPEG' and image.width <= target[0] and image.height <= target[1]:
+        return source
+    if image.mode not in ('RGB', 'L'):
+        # Flatten transparency onto white, as the page behind it
+        background = PILImage.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+        image = background
+    image = image.resize(target, PILImage.LANCZOS) if dpi else image
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=quality or 85, optimize=True)
+    return out.getvalue()
+
+
+class PreparedImage(Flowable):
+    """Draws an image XObject that was read and encoded ahead of time.
+
+    ``Image`` re-reads and re-encodes its source for every document, which
+    for the logo costs more than laying out the rest of the quote. Each
+    document registers a shallow copy of ``xobject`` (a document marks the
+    objects it owns), so the encoded stream itself is shared.
+    """
+
+    def __init__(self, xobject, width, height, hAlign='CENTER'):
+        Flowable.__init__(self)
+        self.xobject = xobject
+        self.drawWidth = width
+        self.drawHeight = height
+        self.hAlign = hAlign
+
+    def wrap(self, availWidth, availHeight):
+        return self.drawWidth, self.drawHeight
+
+    def draw(self):
+        canv = self.canv
+        name = self.xobject.name
+        regName = canv._doc.getXObjectName(name)
+        if canv._doc.idToObject.get(regName) is None:
+            xobject = copy.copy(self.xobject)
+            canv._doc.Reference(xobject, regName)
+            canv._doc.addForm(name, xobject)
+        canv._currentPageHasImages = 1
+        canv.saveState()
+        canv.scale(self.drawWidth, self.drawHeight)
+        canv._code.append(f"/{regName} Do")
+        canv.restoreState()
+        canv._formsinuse.append(name)
+
+
+class ItemsTable(Flowable):
+    """The line items table, laid out one page at a time.
+
+    ``rows`` can be any iterator, such as a generator over a database
+    cursor. Whenever the frame asks for a split, rows are measured only
+    until the space left is filled, and those that fit are drawn as a Table
+    under the header row, so every page repeats the header and only about a
+    page of Paragraphs exists at once. A single Table re-measures all its
+    remaining rows at every page break, which makes long quotes quadratic.
+    """
+
+    def __init__(self, header, rows, col_widths, style, min_row_height=MIN_ITEM_ROW_HEIGHT):
+        Flowable.__init__(self)
+        self.header = header
+        self.rows = iter(rows)
+        self.col_widths = col_widths
+        self.style = style
+        self.min_row_height = min_row_height
+        self.header_height = None
+        self.pending = []  # (row, height) measured but not placed yet
+
+    def _measure(self, rows, availWidth):
+        table = Table(rows, colWidths=self.col_widths, style=self.style)
+        table.wrap(availWidth, 0)
+        return table._rowHeights
+
+    def _fill(self, availWidth, availHeight):
+        """Measure rows until they overflow ``availHeight`` or run out"""
+        height = sum(h for _, h in self.pending)
+        while height <= availHeight:
+            count = int((availHeight - height) // self.min_row_height) + 1
+            rows = list(itertools.islice(self.rows, count))
+            if not rows:
+                break
+            heights = self._measure(rows, availWidth)
+            self.pending.extend(zip(rows, heights))
+            height += sum(heights)
+
+    def wrap(self, availWidth, availHeight):
+        # Never drawn itself: claim more than the space left so it gets split
+        return availWidth, availHeight + 1
+
+    def split(self, availWidth, availHeight):
+        if self.header_height is None:
+            self.header_height = self._measure([self.header], availWidth)[0]
+        space = availHeight - self.header_height
+        # Always measure at least the next row, even with no room for it
+        self._fill(availWidth, max(space, 0))
+        count, used = 0, 0
+        for _, height in self.pending:
+            if used + height > space:
+                break
+            used += height
+            count += 1
+        if not count and (self.pending or space < 0):
+            return []  # not even the header and one row fit: try the next page
+        placed = self.pending[:count]
+        del self.pending[:count]
+        table = Table([self.header] + [row for row, _ in placed], colWidths=self.col_widths,
+                      rowHeights=[self.header_height] + [h for _, h in placed], style=self.style)
+        # The document marks flowables it had to move to a new page and
+        # fails if they are moved twice; this one comes back every page
+        self.__dict__.pop('_postponed', None)
+        # Rows are only left over when the next one did not fit on this page
+        return [table, PageBreak(), self] if self.pending else [table]
+
+    def draw(self):
+        pass
+
+
+def item_rows(items, template):
+    """Items table rows: one per item, plus one for its notes if it has any"""
+    for idx, item in enumerate(items, start=1):
+        name = item.get('service', item.get('name', 'Unknown Item'))
+        if item.get('subService'):
+            name += f" - {item['subService']}"
+
+        qty = float(item.get('quantity', 0))
+
+        yield [
+            str(idx),
+            Paragraph(name, template.header_text),
+            f"{qty} {item.get('unit','')}"
+        ]
+
+        if item.get('notes'):
+            yield ['', Paragraph(f"<i>Note: {item['notes']}</i>", template.note_style), '']
+
+
+class PageCompressingCanvas(Canvas):
+    """A Canvas that compresses each page's content as soon as it is done.
+
+    ReportLab otherwise keeps every page's drawing operators as text until
+    save(), which for a quote thousands of lines long takes more memory
+    than anything else. The file written is byte for byte the same.
+    """
+
+    def showPage(self):
+        Canvas.showPage(self)
+        page = self._doc.Pages.pages[-1]
+        if page.compression and page.stream:
+            # The Filter entry tells the stream its content is already encoded
+            contents = PDFStream(PDFDictionary({"Filter": PDFArray([PDFName(PDFZCompress.pdfname)])}),
+                                 PDFZCompress.encode(page.stream))
+            contents.__Comment__ = "page stream"
+            page.Contents = contents
+            page.stream = None
+
+
+class QuoteTemplate:
+    """Everything generate_pdf needs that does not depend on the invoice.
+
+    Built once per process by ``get_quote_template``: paragraph and table
+    styles, the logo encoded as a PDF image, and the footer markup for the
+    current company settings (rebuilt only when those settings change).
+    Flowables themselves are never shared, since ReportLab mutates them
+    during layout.
+    """
+
+    def __init__(self, logo_path, logo_dpi=None, logo_quality=None):
+        styles = getSampleStyleSheet()
+        self.heading2 = styles['Heading2']
+
+        # --- HEADER STYLES ---
+        self.header_title = ParagraphStyle('HeaderTitle', parent=styles['Heading1'], fontSize=24, spaceAfter=8, textColor=colors.black)
+        self.header_text = ParagraphStyle('HeaderText', parent=styles['Normal'], fontSize=10, leading=14)
+        self.total_label_style = ParagraphStyle('TotalLabel', parent=styles['Normal'], alignment=TA_RIGHT)
+        self.note_style = ParagraphStyle('note', parent=styles['Normal'], fontSize=9, textColor=colors.grey, fontName='Helvetica-Oblique')
+
+        # --- JOB SUMMARY STYLES ---
+        # Style for "JOB SUMMARY:" and "# Title"
+        self.summary_main = ParagraphStyle('SummaryMain', parent=styles['Normal'], fontSize=11, leading=15, fontName='Helvetica-Bold', spaceBefore=10, spaceAfter=4)
+        # Style for "## Subtitle" (Just bold, same size as text)
+        self.summary_sub = ParagraphStyle('SummarySub', parent=styles['Normal'], fontSize=10, leading=14, fontName='Helvetica-Bold', spaceBefore=3)
+        # Style for "* Bullet"
+        self.summary_bullet = ParagraphStyle('SummaryBullet', parent=styles['Normal'], fontSize=10, leading=14, leftIndent=12)
+
+        # --- TABLE STYLES ---
+        self.header_table_style = TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+            ('ALIGN', (0,0), (0,0), 'LEFT'),
+            ('ALIGN', (1,0), (1,0), 'RIGHT'),
+            ('LEFTPADDING', (0,0), (-1,-1), 0),
+            ('RIGHTPADDING', (0,0), (-1,-1), 0),
+        ])
+        self.items_table_style = TableStyle([
+            ('GRID',(0,0),(-1,-1),0.5,colors.grey),
+            ('FONTNAME',(0,0),(-1,0),'Helvetica-Bold'),
+            ('BACKGROUND',(0,0),(-1,0),colors.grey),
+            ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
+            ('ALIGN',(0,0),(0,-1),'CENTER'),
+            ('ALIGN',(2,0),(-1,-1),'CENTER'),
+            ('VALIGN',(0,0),(-1,-1),'TOP'),
+        ])
+        self.totals_table_style = TableStyle([
+            ('ALIGN',(2,0),(-1,-1),'RIGHT'),
+            ('VALIGN',(0,0),(-1,-1),'TOP'),
+            ('LINEABOVE', (0,0), (-1,0), 1, colors.black),
+        ])
+
+        self.logo_xobject = None
+        if os.path.exists(logo_path):
+            data = encode_logo(logo_path, logo_dpi, logo_quality)
+            self.logo_xobject = PDFImageXObject(f"logo_{hashlib.md5(data).hexdigest()}")
+            self.logo_xobject.loadImageFromJPEG(io.BytesIO(data))
+
+        # (settings key, footer), replaced whole so concurrent renders never
+        # pair one company's footer with another's key
+        self._footer = (None, None)
+
+    def logo(self):
+        """A fresh logo flowable backed by the pre-encoded image"""
+        if self.logo_xobject is None:
+            return Paragraph("<b>LOGO</b>", self.header_title)
+        return PreparedImage(self.logo_xobject, *LOGO_SIZE, hAlign='RIGHT')
+
+    def footer(self, settings):
+        """``(payment_html_prefix, contact_html)`` for these company settings"""
+        key = json.dumps(settings, sort_keys=True, default=str)
+        cached_key, footer = self._footer
+        if key != cached_key:
+            payment_html = f"""
+    <b>Account Name:</b> {settings.get('bank_account_name', '')}<br/>
+    <b>BSB:</b> {settings.get('bank_bsb', '')}<br/>
+    <b>Account Number:</b> {settings.get('bank_account', '')}<br/>
+    <b>Reference:</b> """
+            contact_info = f"""
+    <b>CONTACT:</b><br/>
+    {settings.get('company_name', '')}<br/>
+    {settings.get('phone', '')}<br/>
+    {settings.get('email', '')}<br/>
+    {settings.get('address', '')}<br/>
+    <b>{settings.get('area_manager', '')}</b>
+    """
+            footer = (payment_html, contact_info)
+            self._footer = (key, footer)
+        return footer
+
+
+_quote_templates = {}
+
+def get_quote_template(logo_path, logo_dpi=None, logo_quality=None):
+    """The process-wide QuoteTemplate for these logo settings, built on first use"""
+    key = (logo_path, logo_dpi, logo_quality)
+    template = _quote_templates.get(key)
+    if template is None:
+        template = _quote_templates[key] = QuoteTemplate(logo_path, logo_dpi, logo_quality)
+    return template
+
+def generate_pdf(invoice, settings, job_summary_text, template, out=None):
+    """Render a quote; returns ``(buffer, flowables_seconds, build_seconds)``.
+
+    Writes to ``out`` (any binary file) when given, else a new BytesIO.
+    ``invoice['items']`` may be any iterable of items; they are turned into
+    table rows only as pages are laid out, so that work counts as build time.
+    """
+    started = time.perf_counter()
+    buffer = out if out is not None else io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4,
+                            topMargin=15*mm, bottomMargin=15*mm,
+                            leftMargin=15*mm, rightMargin=15*mm,
+                            pageCompression=1)
+
+    header_title = template.header_title
+    header_text = template.header_text
+    total_label_style = template.total_label_style
+    summary_main = template.summary_main
+    summary_sub = template.summary_sub
+    summary_bullet = template.summary_bullet
+
+    elements = []
+
+    # ================= HEADER SECTION =================
+    quote_num = invoice.get('quote_number', 'N/A')
+    try:
+        date_obj = datetime.fromisoformat(invoice['created_at'].replace('Z', '+00:00'))
+        date_str = date_obj.strftime('%d %B %Y')
+    except:
+        date_str = datetime.now().strftime('%d %B %Y')
+
+    left_column = [
+        Paragraph("<b>QUOTE</b>", header_title),
+        Paragraph(f"<b>Quote No:</b> {quote_num}", header_text),
+        Paragraph(f"<b>Quote Date:</b> {date_str}", header_text),
+        Paragraph(f"<b>ABN:</b> {settings.get('abn', '')}", header_text),
+        Spacer(1, 5*mm),
+        Paragraph("<b>QUOTE TO:</b>", header_text),
+        Paragraph(f"<b>Client Name:</b> {invoice.get('client_name', '')}", header_text),
+        Paragraph(f"<b>Client Number:</b> {invoice.get('client_number', '')}", header_text),
+    ]
+
+    right_column = [template.logo()]
+
+    header_data = [[left_column, right_column]]
+    header_table = Table(header_data, colWidths=[100*mm, 80*mm])
+    header_table.setStyle(template.header_table_style)
+    elements.append(header_table)
+    elements.append(Spacer(1, 5*mm))
+
+    # ================= JOB SUMMARY (Logic Updated) =================
+    if job_summary_text:
+        # Main Title
+        elements.append(Paragraph("JOB SUMMARY:", summary_main))
+
+        for line in job_summary_text.split('\n'):
+            line = line.strip()
+            if not line:
+                continue 
+
+            # CHECK 1: Starts with ## (Just Bold)
+            if line.startswith('##'):
+                clean_text = line[2:].strip() # Remove first 2 chars
+                elements.append(Paragraph(clean_text, summary_sub))
+            
+            # CHECK 2: Starts with # (Main Header Style)
+            elif line.startswith('#'):
+                clean_text = line[1:].strip() # Remove first 1 char
+                elements.append(Paragraph(clean_text, summary_main))
+                
+            # CHECK 3: Bullets
+            elif line.startswith('*') or line.startswith('-'):
+                clean_text = line.lstrip('*-').strip()
+                elements.append(Paragraph(f"• {clean_text}", summary_bullet))
+                
+            # CHECK 4: Normal Text
+            else:
+                elements.append(Paragraph(line, header_text))
+        
+        elements.append(Spacer(1, 5*mm))
+
+    # ================= ITEMS TABLE =================
+    items = invoice.get('items', [])
+    if isinstance(items, str):
+        items = json.loads(items)
+
+    elements.append(ItemsTable(ITEM_HEADER, item_rows(items, template),
+                               ITEM_COLUMN_WIDTHS, template.items_table_style))
+
+    # ================= TOTALS =================
+    subtotal = float(invoice.get('total', 0))
+    gst = subtotal * 0.1
+    grand_total = subtotal + gst
+
+    totals_data = [
+        ['', Paragraph('<b>Subtotal:</b>', total_label_style), f"${subtotal:.2f}"],
+        ['', Paragraph('<b>GST (10%):</b>', total_label_style), f"${gst:.2f}"],
+        ['', Paragraph('<b>Total:</b>', total_label_style), f"${grand_total:.2f}"],
+    ]
+    table = Table(totals_data, colWidths=ITEM_COLUMN_WIDTHS)
+    table.setStyle(template.totals_table_style)
+    elements.append(table)
+    elements.append(Spacer(1, 10*mm))
+
+    # ================= PAYMENT & FOOTER =================
+    payment_html, contact_info = template.footer(settings)
+
+    elements.append(Paragraph("<b>PAYMENT OPTIONS</b>", template.heading2))
+    elements.append(Spacer(1, 2*mm))
+    elements.append(Paragraph(payment_html + f"{quote_num}\n    ", header_text))
+
+    elements.append(Spacer(1, 20*mm))
+    elements.append(Paragraph(contact_info, header_text))
+
+    built = time.perf_counter()
+    doc.build(elements, canvasmaker=PageCompressingCanvas)
+    finished = time.perf_counter()
+    return buffer, built - started, finished - built
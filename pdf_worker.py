@@ -0,0 +1,34 @@
+"""Render queued PDF jobs created through POST /api/invoices/<id>/pdf-jobs.
+
+Run one or more of these next to the web workers:
+
+    SUPABASE_DB_URL=... python pdf_worker.py --processes 4
+"""
+import argparse
+import multiprocessing
+
+from app import init_database, run_pdf_job_worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                        help="worker processes to run (default: CPU count)")
+    args = parser.parse_args()
+    if not init_database():
+        raise SystemExit(1)
+
+    if args.processes <= 1:
+        run_pdf_job_worker()
+        return
+
+    workers = [multiprocessing.Process(target=run_pdf_job_worker, daemon=True)
+               for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    main()
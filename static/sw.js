@@ -1,12 +1,192 @@
 // sw.js
-const CACHE = 'site-cache-v1';
-const FILES = [
-  '/', '/index.html', '/styles.css', '/main.js', '/manifest.json'
+// Bump VERSION whenever a file in SHELL changes so clients pick it up.
+const VERSION = 'v4';
+const SHELL_CACHE = `shell-${VERSION}`;
+const API_CACHE = 'api-v1';
+const SHELL = ['/', '/manifest.json', '/static/logo.jpg'];
+
+// Read-mostly endpoints answered from cache, then revalidated with their ETag
+const SWR_PATHS = ['/api/services', '/api/company-settings'];
+
+// Writes that make a cached endpoint stale
+const INVALIDATES = [
+  [/^\/api\/services/, '/api/services'],
+  [/^\/api\/company-settings/, '/api/company-settings'],
+  [/^\/api\/invoices$/, '/api/company-settings'],   // next quote number moved
 ];
 
+const OUTBOX_DB = 'quote-outbox';
+const OUTBOX_STORE = 'requests';
+const SYNC_TAG = 'invoice-outbox';
+
 self.addEventListener('install', e => {
-  e.waitUntil(caches.open(CACHE).then(c => c.addAll(FILES)));
+  e.waitUntil(
+    caches.open(SHELL_CACHE)
+      .then(c => c.addAll(SHELL.map(url => new Request(url, { cache: 'reload' }))))
+      .then(() => self.skipWaiting())
+  );
 });
+
+self.addEventListener('activate', e => {
+  e.waitUntil(
+    caches.keys()
+      .then(keys => Promise.all(keys
+        .filter(k => k !== SHELL_CACHE && k !== API_CACHE)
+        .map(k => caches.delete(k))))
+      .then(() => self.clients.claim())
+      .then(() => flushOutbox().catch(() => {}))
+  );
+});
+
 self.addEventListener('fetch', e => {
-  e.respondWith(caches.match(e.request).then(r => r || fetch(e.request)));
+  const url = new URL(e.request.url);
+  if (url.origin !== self.location.origin) return;
+
+  if (e.request.method === 'POST' && url.pathname === '/api/invoices') {
+    e.respondWith(createInvoice(e.request));
+  } else if (e.request.method !== 'GET') {
+    e.respondWith(fetch(e.request).then(response => {
+      if (response.ok) invalidate(url.pathname);
+      return response;
+    }));
+  } else if (SWR_PATHS.includes(url.pathname) && !url.search) {
+    e.respondWith(staleWhileRevalidate(e, url));
+  } else if (e.request.mode === 'navigate' || SHELL.includes(url.pathname)) {
+    e.respondWith(shell(e, url));
+  }
+  // Everything else (invoice lists, PDFs, ...) goes straight to the network
 });
+
+// --- SHELL ---
+
+// Cached shell immediately, refreshed in the background for the next load
+function shell(e, url) {
+  const key = e.request.mode === 'navigate' ? '/' : url.pathname;
+  return caches.open(SHELL_CACHE).then(cache => cache.match(key).then(cached => {
+    const network = fetch(e.request).then(response => {
+      if (response.ok) cache.put(key, response.clone());
+      return response;
+    });
+    if (cached) {
+      e.waitUntil(network.catch(() => {}));
+      return cached;
+    }
+    return network;
+  }));
+}
+
+// --- API: STALE-WHILE-REVALIDATE ---
+
+// The page's own If-None-Match is answered here; the server is revalidated
+// with the cached response's ETag, and pages are told when it changed.
+function staleWhileRevalidate(e, url) {
+  return caches.open(API_CACHE).then(cache => cache.match(url.pathname).then(cached => {
+    const etag = cached && cached.headers.get('ETag');
+    const headers = etag ? { 'If-None-Match': etag } : {};
+    const network = fetch(url.pathname, { headers, cache: 'no-store' }).then(response => {
+      if (response.status === 304 && cached) return cached;
+      if (response.ok) {
+        cache.put(url.pathname, response.clone());
+        if (cached) notifyClients({ type: 'api-updated', path: url.pathname });
+      }
+      return response;
+    });
+
+    if (!cached) return network;
+    e.waitUntil(network.catch(() => {}));
+    const asked = e.request.headers.get('If-None-Match');
+    if (asked && etag && asked === etag) {
+      return new Response(null, { status: 304, headers: { 'ETag': etag } });
+    }
+    return cached;
+  }));
+}
+
+function invalidate(pathname) {
+  const stale = INVALIDATES.filter(([pattern]) => pattern.test(pathname)).map(([, path]) => path);
+  if (!stale.length) return Promise.resolve();
+  return caches.open(API_CACHE).then(cache => Promise.all(stale.map(path => cache.delete(path))));
+}
+
+function notifyClients(message) {
+  return self.clients.matchAll({ type: 'window' })
+    .then(clients => clients.forEach(client => client.postMessage(message)));
+}
+
+// --- OFFLINE INVOICE CREATES ---
+
+// Creates that cannot reach the server are stored and answered with 202;
+// they are replayed by Background Sync, or when a page reports it is back
+// online where that API is missing. Each body carries a client-generated
+// id, so a replay whose response was lost is not saved twice.
+function createInvoice(request) {
+  const copy = request.clone();
+  return fetch(request).then(response => {
+    if (response.ok) invalidate('/api/invoices');
+    return response;
+  }).catch(() => copy.text().then(body => queueRequest({
+    url: copy.url,
+    body,
+    headers: { 'Content-Type': 'application/json' },
+    queuedAt: Date.now()
+  })).then(() => {
+    if (self.registration.sync) self.registration.sync.register(SYNC_TAG).catch(() => {});
+    return new Response(JSON.stringify({ queued: true }), {
+      status: 202,
+      headers: { 'Content-Type': 'application/json' }
+    });
+  }));
+}
+
+self.addEventListener('sync', e => {
+  if (e.tag === SYNC_TAG) e.waitUntil(flushOutbox());
+});
+
+self.addEventListener('message', e => {
+  if (e.data && e.data.type === 'flush-outbox') e.waitUntil(flushOutbox().catch(() => {}));
+});
+
+function openOutbox() {
+  return new Promise((resolve, reject) => {
+    const open = indexedDB.open(OUTBOX_DB, 1);
+    open.onupgradeneeded = () => open.result.createObjectStore(OUTBOX_STORE, { keyPath: 'key', autoIncrement: true });
+    open.onsuccess = () => resolve(open.result);
+    open.onerror = () => reject(open.error);
+  });
+}
+
+function outbox(mode, fn) {
+  return openOutbox().then(db => new Promise((resolve, reject) => {
+    const tx = db.transaction(OUTBOX_STORE, mode);
+    const result = fn(tx.objectStore(OUTBOX_STORE));
+    tx.oncomplete = () => resolve(result && result.result);
+    tx.onerror = () => reject(tx.error);
+  }));
+}
+
+const queueRequest = entry => outbox('readwrite', store => store.add(entry));
+const queuedRequests = () => outbox('readonly', store => store.getAll());
+const dequeue = key => outbox('readwrite', store => store.delete(key));
+
+let flushing = null;
+
+// Replay queued creates in order. A network failure stops the run (and
+// makes a sync event retry later); a server rejection drops the entry.
+function flushOutbox() {
+  if (flushing) return flushing;
+  flushing = queuedRequests().then(async entries => {
+    let sent = 0, rejected = 0;
+    for (const entry of entries || []) {
+      const response = await fetch(entry.url, { method: 'POST', headers: entry.headers, body: entry.body });
+      if (response.ok) sent++;
+      else if (response.status >= 400 && response.status < 500) rejected++;
+      else throw new Error(`Replay failed with ${response.status}`);
+      await dequeue(entry.key);
+    }
+    if (sent || rejected) {
+      await invalidate('/api/invoices');
+      await notifyClients({ type: 'outbox-synced', sent, rejected });
+    }
+  }).finally(() => { flushing = null; });
+  return flushing;
+}